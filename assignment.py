@@ -0,0 +1,64 @@
+class Statistics:
+  """Number of checks and alarms of an assignment"""
+  __slots__ = ("count", "alarm")
+
+  def __init__(self, count=0, alarm=0):
+    self.count = count
+    self.alarm = alarm
+
+  def __reduce__(self):
+    return Statistics, (self.count, self.alarm)
+
+  def __repr__(self):
+    return f"Statistics(count={self.count}, alarm={self.alarm})"
+
+  @classmethod
+  def of(cls, statistics):
+    """Converts the {"count": ..., "alarm": ...} dict of older versions"""
+    if isinstance(statistics, cls):
+      return statistics
+    statistics = statistics or {}
+    return cls(statistics.get("count", 0), statistics.get("alarm", 0))
+
+
+class Assignment:
+  """A job of a user. Without an instance dict and pickled as a versioned tuple, so tens of thousands of them stay small.
+  The Stored_Update of each Service has its own type (see the migrate_*_state functions of logic.py):
+  Zalando a tuple of the available sizes, Simple Update Check a PageState, Search for ... an int bit mask (None before the first check),
+  Search in List a frozenset of fingerprints.
+  Pickles of older versions, which stored the attribute dict, are upgraded when they are loaded and marked as Upgraded."""
+  VERSION = 2
+  # Stored fields in the order of the pickled tuple, new fields are appended with a new VERSION
+  FIELDS = ("JobID", "ChatID", "Service", "Interval", "Name", "Link", "Search_For", "Stored_Update", "Statistics",
+            "Max_Interval", "Effective_Interval")
+  __slots__ = FIELDS + ("Upgraded",)
+
+  def __init__(self, JobID, ChatID, Service, Interval, Name, Link, Search_For, Stored_Update, Statistics, Max_Interval=None):
+    self.JobID = JobID
+    self.ChatID = ChatID
+    self.Service = Service
+    self.Interval = Interval
+    self.Name = Name
+    self.Link = Link
+    self.Search_For = Search_For
+    self.Stored_Update = Stored_Update
+    self.Statistics = Statistics
+    # Adaptive jobs poll between Interval and Max_Interval, currently every Effective_Interval seconds
+    self.Max_Interval = Max_Interval
+    self.Effective_Interval = Interval
+    self.Upgraded = False
+
+  def __getstate__(self):
+    return (self.VERSION,) + tuple(getattr(self, name) for name in self.FIELDS)
+
+  def __setstate__(self, state):
+    if isinstance(state, dict):
+      # Version 1: the attribute dict of the former plain class, adaptive intervals were added later
+      state = (1,) + tuple(state.get(name) for name in self.FIELDS)
+    version, values = state[0], state[1:]
+    for name, value in zip(self.FIELDS, values):
+      setattr(self, name, value)
+    self.Statistics = Statistics.of(self.Statistics)
+    if self.Effective_Interval is None:
+      self.Effective_Interval = self.Interval
+    self.Upgraded = version < self.VERSION
@@ -0,0 +1,32 @@
+"""Compares generating browser headers for every request with handing them out from the header pool.
+
+    python benchmarks/bench_headers.py [requests]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logic import HeaderPool, fake_headers
+
+
+def measure(function, repetitions):
+    start = time.process_time()
+    for _ in range(repetitions):
+        function()
+    return (time.process_time() - start) / repetitions
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    hosts = [f"shop{number}.example" for number in range(100)]
+    pool = HeaderPool()
+    before = measure(fake_headers, repetitions)
+    requests = iter(range(repetitions))
+    after = measure(lambda: pool.headers(hosts[next(requests) % len(hosts)]), repetitions)
+    print(f"per request: generated {before * 1e6:8.1f} µs | pool {after * 1e6:8.1f} µs ({before / after:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
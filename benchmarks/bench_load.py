@@ -0,0 +1,184 @@
+"""Measures how many assignments one bot instance sustains.
+
+Starts the stand-in shops of shop_server.py in a separate process, schedules N assignments of all four services
+on the job queue of the bot and runs them for a while without Telegram. Alarms go to a fake bot.
+Reports checks per second, scheduling lag, check latency and the peak RSS of the bot process.
+
+    python benchmarks/bench_load.py [--jobs 1000] [--interval 10] [--duration 60] [--shops 100]
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import types
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+try:
+    import auth
+except ImportError:
+    # bot.py reads Token, Admin and Whitelist from auth.py, which is not needed without Telegram
+    auth = types.ModuleType("auth")
+    auth.Token, auth.Admin, auth.Whitelist = "", 0, False
+    sys.modules["auth"] = auth
+
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MAX_INSTANCES
+from telegram.ext import Application
+
+import bot
+import logic
+import shop_server
+from assignment import Statistics
+
+
+class FakeBot:
+  """Stands in for telegram.Bot and only counts the messages"""
+  def __init__(self):
+    self.messages = 0
+
+  async def send_message(self, chat_id, text, **options):
+    self.messages += 1
+
+
+class FailureCounter(logging.Handler):
+  """Counts the checks the bot logs as not successful"""
+  def __init__(self):
+    super().__init__(logging.INFO)
+    self.failures = 0
+
+  def emit(self, record):
+    if "not successful" in record.getMessage().lower():
+      self.failures += 1
+
+
+def assignments(jobs, addresses, interval):
+    """Returns N assignments spread over all services and shops"""
+    result = []
+    for number in range(jobs):
+        base = f"http://{addresses[number % len(addresses)]}"
+        kind = number % 4
+        JobID = f"load-{number}"
+        statistics = Statistics()
+        if kind == 0:
+            result.append((bot.alarm, bot.Assignment(JobID, number, "🔄 Zalando", interval, JobID, f"{base}/zalando/{number}", ["M", "XL"], (), statistics)))
+        elif kind == 1:
+            result.append((bot.suc_alarm, bot.Assignment(JobID, number, "🔄 Simple Update Check", interval, JobID, f"{base}/page/{number}", None, logic.migrate_suc_state(""), statistics)))
+        elif kind == 2:
+            search_for, stored_update = logic.migrate_sfs_state(["Ausverkauft", r"/\d+ left/"], None)
+            result.append((bot.sfs_alarm, bot.Assignment(JobID, number, "🔄 Search for ...", interval, JobID, f"{base}/page/{number}", search_for, stored_update, statistics)))
+        else:
+            result.append((bot.sil_alarm, bot.Assignment(JobID, number, "🔄 Search in List", interval, JobID, f"{base}/list/{number}", "results", logic.migrate_sil_state([]), statistics)))
+    return result
+
+
+async def run(args, addresses):
+    application = Application.builder().token("0:benchmark").build()
+    job_queue = application.job_queue
+    fake_bot = FakeBot()
+    bot.notifier.start(fake_bot)
+    if args.workers:
+        bot.worker_pool = bot.WorkerPool(args.workers)
+        bot.worker_pool.start()
+    # Each shop is one host, the per-host limits of the bot apply as they would in production
+    logic.host_scheduler.requests_per_second = args.host_rps
+
+    submitted = {}
+    lags = []
+    latencies = []
+    running = [0]
+    skipped = [0]
+
+    def on_submitted(event):
+        submitted[event.job_id] = event.scheduled_run_times[-1]
+    job_queue.scheduler.add_listener(on_submitted, EVENT_JOB_SUBMITTED)
+
+    def on_skipped(event):
+        # The previous check of the job was still running
+        skipped[0] += 1
+    job_queue.scheduler.add_listener(on_skipped, EVENT_JOB_MAX_INSTANCES)
+
+    def measured(callback):
+        async def check(context):
+            scheduled = submitted.pop(context.job.job.id, None)
+            if scheduled is not None:
+                lags.append(max(0.0, (datetime.now(timezone.utc) - scheduled).total_seconds()))
+            start = time.perf_counter()
+            running[0] += 1
+            try:
+                await callback(context)
+            finally:
+                running[0] -= 1
+            latencies.append(time.perf_counter() - start)
+        return check
+
+    await job_queue.start()
+    for callback, assignment in assignments(args.jobs, addresses, args.interval):
+        bot.schedule_assignment(job_queue, measured(callback), assignment, stagger=True)
+    start = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - start
+    # Stopping the scheduler cancels running checks, so they are finished first
+    job_queue.scheduler.pause()
+    while running[0]:
+        await asyncio.sleep(0.1)
+    await job_queue.stop(wait=False)
+    # The workers count their conditional requests themselves
+    collected = await bot.collect_diagnostics()
+    if bot.worker_pool is not None:
+        await bot.worker_pool.close()
+    await bot.notifier.close()
+    await logic.close_client()
+    return lags, latencies, skipped[0], elapsed, fake_bot.messages, collected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs N assignments against local stand-in shops and reports the throughput.")
+    parser.add_argument("--jobs", type=int, default=1000, help="number of assignments")
+    parser.add_argument("--interval", type=float, default=10, help="check interval of every assignment in seconds")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--shops", type=int, default=100, help="number of stand-in shops (hosts)")
+    parser.add_argument("--host-rps", type=float, default=logic.HOST_REQUESTS_PER_SECOND, help="requests per second per host")
+    parser.add_argument("--change-every", type=float, default=30, help="seconds until a page changes")
+    parser.add_argument("--padding-kb", type=int, default=200, help="size of the filler around the content of a page")
+    parser.add_argument("--delay-ms", type=float, default=0, help="response delay of the shops")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes for the checks (0: in the bot process)")
+    args = parser.parse_args()
+
+    # The shops run in their own process, so their memory and CPU do not count for the bot
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    shops = multiprocessing.Process(
+        target=shop_server.serve, args=(args.shops, args.change_every, args.padding_kb, args.delay_ms, sender), daemon=True)
+    shops.start()
+    addresses = receiver.recv()
+
+    # Log records are still created and counted, but not printed
+    logging.getLogger().handlers.clear()
+    logging.getLogger("apscheduler").setLevel(logging.ERROR)
+    failures = FailureCounter()
+    logging.getLogger(bot.__name__).addHandler(failures)
+    try:
+        lags, latencies, skipped, elapsed, messages, collected = asyncio.run(run(args, addresses))
+    finally:
+        shops.terminate()
+
+    lags.sort()
+    latencies.sort()
+    print(f"{args.jobs} jobs every {args.interval:g} s on {args.shops} shops for {elapsed:.0f} s, {args.workers} worker processes")
+    print(f"checks: {len(latencies)} ({len(latencies) / elapsed:.1f}/s, expected {args.jobs / args.interval:.1f}/s), "
+          f"{skipped} skipped while the previous check was running, {failures.failures} not successful, {messages} messages sent")
+    print(f"scheduling lag: p50 {logic.percentile(lags, 0.5) * 1000:.1f} ms, p99 {logic.percentile(lags, 0.99) * 1000:.1f} ms, "
+          f"max {logic.percentile(lags, 1) * 1000:.1f} ms")
+    print(f"check latency: p50 {logic.percentile(latencies, 0.5) * 1000:.1f} ms, p99 {logic.percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"conditional GET: {logic.conditional_statistics(collected['conditional'])}")
+    # ru_maxrss is in KiB on Linux
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB bot, "
+          f"{resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.1f} MiB largest worker or shop process")
+
+
+if __name__ == "__main__":
+    main()
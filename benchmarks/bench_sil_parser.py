@@ -0,0 +1,63 @@
+"""Compares the HTML parsing backends of Search in List with the former full html.parser path.
+
+    python benchmarks/bench_sil_parser.py [repetitions]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bs4 import BeautifulSoup
+from logic import find_list_element, html_parser
+from pages import html_list
+
+
+def former_path(content, target):
+    """The path sil_alarm used before: full html.parser tree, then find by ID and by class"""
+    soup = BeautifulSoup(content, 'html.parser')
+    target_element = soup.find(id=target)
+    if not target_element:
+        target_element = soup.find(class_=target)
+    return target_element
+
+
+def children(element):
+    return [str(child) for child in element.find_all(recursive=False)]
+
+
+def measure(function, repetitions):
+    start = time.process_time()
+    for _ in range(repetitions):
+        function()
+    return (time.process_time() - start) / repetitions
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    variants = [("html.parser", True)]
+    if html_parser("lxml") == "lxml":
+        variants += [("lxml", False), ("lxml", True)]
+    else:
+        print("lxml is not installed, only html.parser is compared")
+    # The class fallback has to find lists with several classes, too
+    pages = [(padding_kb, html_list(padding_kb=padding_kb)) for padding_kb in (200, 2000)]
+    pages.append((200, html_list(padding_kb=200, list_id="main-list", list_class="list results  wide")))
+    for padding_kb, page in pages:
+        content = page.encode("utf-8")
+        for target in ("results", "entry-list-missing"):
+            expected = former_path(content, target)
+            before = measure(lambda: former_path(content, target), repetitions)
+            line = f"{len(content) / 1024 / 1024:4.1f} MB, target {target!r:22}: former {before * 1000:8.1f} ms"
+            for parser, targeted in variants:
+                element = find_list_element(content, target, parser, targeted)
+                assert (element is None) == (expected is None)
+                if element is not None:
+                    assert children(element) == children(expected)
+                after = measure(lambda: find_list_element(content, target, parser, targeted), repetitions)
+                line += f" | {parser}{' targeted' if targeted else ''} {after * 1000:8.1f} ms ({before / after:5.1f}x)"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Compares the former multi-pass Zalando parsing with the single-pass snapshot parser.
+
+    python benchmarks/bench_zalando_parser.py [repetitions]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logic import extract_zalando_json, parse_all_sizes, parse_available_sizes, parse_name, parse_zalando_snapshot
+from pages import zalando_page
+
+
+def multi_pass(txt):
+    """The path alarm and link used before: two index scans, three json.loads"""
+    data = extract_zalando_json(txt)
+    return parse_name(data), parse_all_sizes(data), parse_available_sizes(data)
+
+
+def single_pass(txt):
+    snapshot = parse_zalando_snapshot(txt)
+    return snapshot.full_name(), snapshot.All_Sizes, snapshot.Available_Sizes
+
+
+def measure(function, txt, repetitions):
+    start = time.process_time()
+    for _ in range(repetitions):
+        function(txt)
+    return (time.process_time() - start) / repetitions
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for padding_kb in (100, 1500, 4000):
+        txt = zalando_page(padding_kb=padding_kb)
+        assert multi_pass(txt) == single_pass(txt)
+        before = measure(multi_pass, txt, repetitions)
+        after = measure(single_pass, txt, repetitions)
+        print(f"{len(txt) / 1024 / 1024:5.1f} MB page: multi-pass {before * 1000:7.3f} ms, "
+              f"single-pass {after * 1000:7.3f} ms CPU per check ({before / after:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
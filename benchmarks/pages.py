@@ -0,0 +1,36 @@
+"""Synthetic pages used by the benchmarks"""
+import json
+import random
+
+SIZES = ["XS", "S", "M", "L", "XL", "XXL", "36", "37", "38", "39", "40", "41", "42", "43", "44", "45"]
+
+
+def zalando_page(available_sizes=None, padding_kb=1500, seed=0):
+    """Returns a Zalando-style product page with the product JSON embedded between padding"""
+    rng = random.Random(seed)
+    if available_sizes is None:
+        available_sizes = [size for size in SIZES if rng.random() < 0.5]
+    product = {
+        "customer": {"sizeProfile": None},
+        "product": {
+            "brand": {"name": "Triumph"},
+            "name": "Shapewear - white",
+            "simples": [{"size": size, "sku": f"TR581C00X-A11{i:04}"} for i, size in enumerate(SIZES)],
+            "simplesWithStock": [{"size": size, "sku": f"TR581C00X-A11{SIZES.index(size):04}"} for size in available_sizes],
+        },
+    }
+    payload = '{"data":' + json.dumps(product, separators=(",", ":")) + ',"errors":[]}'
+    padding = "<div class=\"filler\">" + "x" * 1000 + "</div>\n"
+    half = padding * (padding_kb // 2)
+    return "<html><head></head><body>" + half + "<script>" + payload + "</script>" + half + "</body></html>"
+
+
+def html_list(entries=200, padding_kb=500, list_id="results", seed=0, list_class=None):
+    """Returns an HTML page with a list of entries inside an element with the given ID and class (default: the ID)"""
+    rng = random.Random(seed)
+    items = "".join(
+        f'<li class="entry"><a href="/item/{i}?ts={rng.randrange(10**9)}">Entry {i}</a><span>{rng.random():.4f}</span></li>'
+        for i in range(entries))
+    padding = "<div class=\"filler\"><p>" + "lorem ipsum " * 80 + "</p></div>\n"
+    half = padding * (padding_kb // 2)
+    return (f'<html><body>{half}<ul id="{list_id}" class="{list_id if list_class is None else list_class}">{items}</ul>{half}</body></html>')
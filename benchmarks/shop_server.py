@@ -0,0 +1,131 @@
+"""Local stand-in for the shops the bot watches.
+
+Every shop is a server on its own loopback address (127.0.0.1, 127.0.0.2, ...), so the per-host limits of the bot
+apply as they do for real shops. Each shop serves
+    /zalando/<n>  Zalando-style product page whose available sizes change over time
+    /page/<n>     plain page that switches between "Ausverkauft" and "Nur 3 left" over time
+    /list/<n>     HTML list that gains and loses entries over time
+with ETags, so conditional requests are answered with 304 while a page is unchanged.
+
+    python benchmarks/shop_server.py [--shops 20] [--change-every 30] [--padding-kb 200] [--delay-ms 0]
+"""
+import argparse
+import hashlib
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from pages import SIZES, zalando_page, html_list
+
+
+class Catalog:
+  """Builds the pages of all shops. Pages only depend on their kind and version, so they are built once per version."""
+  def __init__(self, change_every=30, padding_kb=200):
+    self.change_every = change_every
+    self.padding_kb = padding_kb
+    self._pages = {}
+    self._lock = threading.Lock()
+
+  def version(self, number):
+    # Pages change in eight groups, so not all pages change at the same moment
+    return int((time.time() + number % 8 * self.change_every / 8) // self.change_every)
+
+  def build(self, kind, version):
+    rng = random.Random(version)
+    if kind == "zalando":
+      return zalando_page(available_sizes=[size for size in SIZES if rng.random() < 0.5], padding_kb=self.padding_kb, seed=version)
+    if kind == "page":
+      state = "Ausverkauft" if version % 2 else "Nur 3 left"
+      filler = ("<p>" + "lorem ipsum " * 80 + "</p>\n") * self.padding_kb
+      return f"<html><body>{filler}<b>{state}</b></body></html>"
+    if kind == "list":
+      return html_list(entries=20 + version % 5, padding_kb=self.padding_kb, seed=0)
+    return None
+
+  def page(self, kind, number):
+    """Returns (body, etag) of the current version of the page or None"""
+    version = self.version(number)
+    with self._lock:
+      cached = self._pages.get((kind, version))
+    if cached is None:
+      body = self.build(kind, version)
+      if body is None:
+        return None
+      body = body.encode("utf-8")
+      cached = (body, '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"')
+      with self._lock:
+        # Versions of this kind that are out of use are dropped
+        self._pages = {key: value for key, value in self._pages.items() if key[0] != kind or abs(key[1] - version) <= 2}
+        self._pages[(kind, version)] = cached
+    return cached
+
+
+def handler(catalog, delay):
+    class ShopHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            page = catalog.page(parts[0], int(parts[1])) if len(parts) == 2 and parts[1].isdigit() else None
+            if delay:
+                time.sleep(delay)
+            if page is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body, etag = page
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ShopHandler
+
+
+def serve(shops=20, change_every=30, padding_kb=200, delay_ms=0, addresses=None):
+    """Starts the shops and serves until the process ends. The addresses are sent through the given connection."""
+    catalog = Catalog(change_every, padding_kb)
+    servers = []
+    for number in range(shops):
+        try:
+            servers.append(ThreadingHTTPServer((f"127.0.0.{number % 254 + 1}", 0), handler(catalog, delay_ms / 1000)))
+        except OSError:
+            # Only 127.0.0.1 is available (e.g. macOS), all shops share one host
+            servers.append(ThreadingHTTPServer(("127.0.0.1", 0), handler(catalog, delay_ms / 1000)))
+    for server in servers:
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    if addresses is not None:
+        addresses.send([f"{server.server_address[0]}:{server.server_port}" for server in servers])
+    else:
+        print("Serving shops on", ", ".join(f"{server.server_address[0]}:{server.server_port}" for server in servers))
+    threading.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves synthetic shop pages for the load benchmark.")
+    parser.add_argument("--shops", type=int, default=20, help="number of shops, each on its own address")
+    parser.add_argument("--change-every", type=float, default=30, help="seconds until a page changes")
+    parser.add_argument("--padding-kb", type=int, default=200, help="size of the filler around the content")
+    parser.add_argument("--delay-ms", type=float, default=0, help="delay of every response")
+    args = parser.parse_args()
+    try:
+        serve(args.shops, args.change_every, args.padding_kb, args.delay_ms)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
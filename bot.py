@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 # pylint: disable=C0116,W0613
 from auth import *
+import argparse
+import asyncio
+import functools
 import logging
 import re
+import signal
+import zlib
 import shortuuid
 from logic import *
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, Update
@@ -15,13 +20,20 @@ from telegram.ext import (
     CallbackContext,
     CallbackQueryHandler,
     InvalidCallbackData,
-    PicklePersistence,
     ContextTypes,
+    PersistenceInput,
 )
 import html
 import traceback
 from telegram.constants import ParseMode
-from bs4 import BeautifulSoup
+from storage import SqlitePersistence, JobRegistry
+from assignment import Assignment, Statistics
+from notify import Notifier, ErrorDigest
+from breaker import CircuitBreaker, CircuitOpen, circuit_summary
+from metrics import metrics, serve as serve_metrics
+from profiling import profiler, profiled
+from workers import WorkerPool
+from sharding import HashRing, SqliteCoordinator, shard_key
 
 # Enable logging
 logging.basicConfig(
@@ -31,6 +43,45 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 service_keyboard = [['🔄 Zalando', '🔄 Simple Update Check', '🔄 Search for ...','🔄 Search in List', '🔄 Joblist']]
 
+interval_keyboard = [["3","5","10","30","60","300","600","1800"], ["30-600","60-1800","300-3600"]]
+# Each tick of a job is shifted randomly by up to this share of its interval
+JITTER_RATIO = 0.1
+# A check reuses a response of its Link another job fetched within this share of its interval
+FRESHNESS_RATIO = 0.5
+# Adaptive jobs ("min-max" interval) back off by this factor after this many checks without a change
+ADAPTIVE_BACKOFF = 1.5
+ADAPTIVE_PATIENCE = 3
+
+# Scheduled jobs by JobID and ChatID
+registry = JobRegistry()
+# Outgoing alarms and broadcasts, see notify.py
+notifier = Notifier()
+# Jobs that keep failing are paused (hosts have their own circuits in logic.py), failures reach the admin as one digest
+job_breaker = CircuitBreaker()
+error_digest = ErrorDigest()
+ERROR_DIGEST_INTERVAL = 900
+# Serves the metrics in text exposition format on http://METRICS_HOST:METRICS_PORT/metrics, None to disable
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+metrics_server = None
+# Number of worker processes that download, parse and compare for the checks, 0 runs them in the bot process
+WORKER_PROCESSES = 0
+worker_pool = None
+# Name of this checker node (see --node), None checks all assignments in this process
+SHARD_NODE = None
+# Coordinator file shared by all nodes, assignments are placed on the nodes by the "host" of their Link or by "JobID"
+SHARD_COORDINATOR = "bot_shards.sqlite"
+SHARD_BY = "host"
+# Seconds between two heartbeats, a node that misses three is considered gone
+SHARD_HEARTBEAT = 15
+coordinator = None
+# JobIDs this node holds the claim for
+owned_jobs = set()
+# JobIDs that are handed over once their running checks are done
+handing_over = set()
+# Futures of the running checks per JobID, resolved when the check is done
+running_checks = {}
+
 SERVICE, LINK, SIZES, INTERVAL, JOBLIST, JOBSELECT, SUC_LINK, SUC_INTERVAL, SFS_LINK, SFS_SEARCHTERM, SFS_INTERVAL, SIL_LINK, SIL_SEARCHTERM, SIL_INTERVAL  = range(14)
 
 class Callback:
@@ -38,64 +89,170 @@ class Callback:
     self.Operation = Operation
     self.Parameter = Parameter
 
-class Assignment:
-  def __init__(self, JobID, ChatID, Service, Interval, Name, Link, Search_For, Stored_Update, Statistics):
-    self.JobID = JobID
-    self.ChatID = ChatID
-    self.Service = Service
-    self.Interval = Interval
-    self.Name = Name
-    self.Link = Link
-    self.Search_For = Search_For
-    self.Stored_Update = Stored_Update
-    self.Statistics = Statistics
-  
+
+_quiet_checks = {}
+
+def parse_interval(text):
+    """Parses the interval of the user: "60" for a fixed interval, "60-1800" for an adaptive one. Returns (Interval, Max_Interval)."""
+    if "-" in text:
+        minimum, maximum = (int(value) for value in text.split("-", 1))
+        if minimum <= 0 or maximum < minimum:
+            raise ValueError(text)
+        return minimum, maximum
+    interval = int(text)
+    if interval <= 0:
+        raise ValueError(text)
+    return interval, None
+
+def effective_interval(assignment):
+    """Returns the interval the job of the assignment currently runs at"""
+    return assignment.Effective_Interval or assignment.Interval
+
+def interval_text(assignment):
+    """Describes the interval of an assignment for the job details"""
+    if assignment.Max_Interval is None:
+        return str(assignment.Interval) + " Seconds"
+    return f'{assignment.Interval}-{assignment.Max_Interval} Seconds (currently {effective_interval(assignment):g})'
+
+def adapt_interval(job, changed):
+    """Backs an adaptive job off while it finds nothing and resets it to its minimum interval after a change."""
+    assignment = job.data
+    if assignment.Max_Interval is None:
+        return
+    current = effective_interval(assignment)
+    if changed:
+        _quiet_checks[assignment.JobID] = 0
+        new_interval = assignment.Interval
+    else:
+        _quiet_checks[assignment.JobID] = _quiet_checks.get(assignment.JobID, 0) + 1
+        if _quiet_checks[assignment.JobID] < ADAPTIVE_PATIENCE:
+            return
+        _quiet_checks[assignment.JobID] = 0
+        new_interval = min(assignment.Max_Interval, round(current * ADAPTIVE_BACKOFF))
+    if new_interval != current:
+        assignment.Effective_Interval = new_interval
+        job.job.reschedule(trigger="interval", seconds=new_interval, jitter=new_interval * JITTER_RATIO)
+        logger.info('%s Job "%s" now checks every %s seconds.', str(assignment.Service), str(assignment.Name), str(new_interval))
+
+def start_offset(assignment) -> float:
+    """Spreads the first run of a job over its interval, based on a stable hash of its JobID."""
+    return zlib.crc32(str(assignment.JobID).encode()) % 1000 / 1000 * effective_interval(assignment)
+
+def schedule_assignment(job_queue, callback, assignment, stagger=False):
+    """Adds the repeating job of the given assignment to the queue. 
+    Every tick is jittered, staggered jobs additionally start at an offset within their interval."""
+    job = job_queue.run_repeating(
+        sharded(profiled(callback)),
+        interval=effective_interval(assignment),
+        first=start_offset(assignment) if stagger else None,
+        data=assignment,
+        name=str(assignment.JobID),
+        job_kwargs={"jitter": effective_interval(assignment) * JITTER_RATIO})
+    registry.add(job)
+    return job
+
+def sharded(callback):
+    """Wraps an alarm callback, so a checker node only checks the assignments it holds the claim for.
+    Every node keeps all jobs scheduled, so taking over an assignment needs no rescheduling."""
+    @functools.wraps(callback)
+    async def check(context):
+        if coordinator is None:
+            return await callback(context)
+        JobID = context.job.data.JobID
+        if JobID not in owned_jobs or JobID in handing_over or not coordinator.holds():
+            return
+        # rebalance waits for the running checks before it hands an assignment over
+        done = asyncio.get_running_loop().create_future()
+        running_checks.setdefault(JobID, set()).add(done)
+        try:
+            return await callback(context)
+        finally:
+            running_checks[JobID].discard(done)
+            if not running_checks[JobID]:
+                del running_checks[JobID]
+            done.set_result(None)
+    return check
+
+def unschedule_assignment(JobID):
+    """Removes the job of the given assignment from the queue and the registry. Returns the removed job (or None)."""
+    job = registry.remove(JobID)
+    if job is not None:
+        job.schedule_removal()
+        if worker_pool is not None:
+            worker_pool.forget(JobID, job.data.Link)
+    metrics.forget(JobID)
+    job_breaker.forget(JobID)
+    forget_job(JobID)
+    _quiet_checks.pop(JobID, None)
+    return job
+
+async def run_check(check, assignment):
+    """Runs the check of an assignment in a worker process if there are any, otherwise here. Returns its CheckResult.
+    Raises CircuitOpen while the job or its host is paused. Failures count for the circuit of the job and the error digest."""
+    # Jitter lets the ticks of jobs sharing a Link drift apart, so the shared response is reused for a share of the interval
+    max_age = effective_interval(assignment) * FRESHNESS_RATIO
+    arguments = (assignment.JobID, assignment.Name, assignment.Link, assignment.Search_For, assignment.Stored_Update, max_age)
+    try:
+        job_breaker.acquire(assignment.JobID)
+        if worker_pool is None:
+            result = await check(*arguments)
+        else:
+            result = await worker_pool.check(check.__name__, *arguments)
+    except CircuitOpen as err:
+        error_digest.skip(err.key, err.seconds)
+        raise
+    except Exception as err:
+        error_digest.failure(assignment.JobID, assignment.Name, err, job_breaker.failure(assignment.JobID))
+        raise
+    job_breaker.success(assignment.JobID)
+    return result
+
+async def collect_diagnostics():
+    """Returns the diagnostics of this process and of the worker processes, which run the checks if there are any"""
+    snapshots = [diagnostics()]
+    if worker_pool is not None:
+        snapshots += await worker_pool.diagnostics()
+    return merge_diagnostics(snapshots)
+
+async def collect_metrics():
+    return (await collect_diagnostics())["metrics"]
+
+async def send_error_digest(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sends the failed and paused checks of the last interval to the admin"""
+    text = error_digest.take()
+    if text is not None:
+        notifier.notify(Admin, text)
 
 async def alarm(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send the alarm message, if there is an Update"""
     job = context.job
-    was_soldout = []
-    is_soldout = []
     try:
-        available_sizes = parse_available_sizes(download_zalando_json(job.data.Link))
-        if available_sizes != job.data.Stored_Update:
-            message = ""
-
-            for size in job.data.Search_For:
-                if check_if_soldout(job.data.Stored_Update, size):
-                    was_soldout.append(size)
-                if check_if_soldout(available_sizes, size):
-                    message = message + "\nSize " + size + " not available"
-                    is_soldout.append(size)
-                else:
-                    message = message + "\nSize " + size + " is available!"
-            if was_soldout != is_soldout:
-                if job.data.Statistics["count"] >= 1:
-                    await context.bot.send_message(job.data.ChatID, text= "Update for " + job.data.Name + message + "\n" + job.data.Link)
-                    job.data.Statistics["alarm"] += 1 
-                logger.info('%s Job "%s" found Availability-Update: %s', str(job.data.Service), str(job.data.Name), str(available_sizes))
-                job.data.Statistics["count"] += 1 
-                
-            else:
-                logger.info('%s Job "%s" found irrelevant Availability-Update: %s', str(job.data.Service), str(job.data.Name), str(available_sizes))
-                job.data.Statistics["count"] += 1
-            job.data.Stored_Update = available_sizes
+        result = await run_check(zalando_check, job.data)
+        if result.not_modified:
+            logger.info('%s Job "%s" found no Update. Page not modified.', str(job.data.Service), str(job.data.Name))
+            job.data.Statistics.count += 1
+            adapt_interval(job, False)
+            return
+        if result.changed:
+            if job.data.Statistics.count >= 1:
+                notifier.notify(job.data.ChatID, result.message)
+                job.data.Statistics.alarm += 1 
+            logger.info('%s Job "%s" found Availability-Update: %s', str(job.data.Service), str(job.data.Name), str(result.Stored_Update))
+        elif result.Stored_Update != job.data.Stored_Update:
+            logger.info('%s Job "%s" found irrelevant Availability-Update: %s', str(job.data.Service), str(job.data.Name), str(result.Stored_Update))
         else:
             logger.info('%s Job "%s" found no Update. Stored Availability-Update: %s', str(job.data.Service), str(job.data.Name), str(job.data.Stored_Update))
-            job.data.Statistics["count"] += 1
-            
-    except:
+        if result.Stored_Update != job.data.Stored_Update:
+            job.data.Stored_Update = result.Stored_Update
+        job.data.Statistics.count += 1
+        adapt_interval(job, result.changed)
+
+    except CircuitOpen as err:
+        logger.info('%s Job "%s" skipped: %s', str(job.data.Service), str(job.data.Name), str(err))
+    except Exception as err:
+        metrics.error(job.data.JobID, job.data.Link, err)
+        # The admin gets the failures as one digest, see send_error_digest
         logger.info("Check not Successful. Try again later.")
-        message = (
-            f"Check not Successful:\n"
-            f"<pre>JobID = {html.escape(str(job.data.JobID))}\n"
-            f"Name = {html.escape(str(job.data.Name))}\n"
-            f"ChatID = {html.escape(str(job.data.ChatID))}</pre>"
-            )
-        # Contacting Admin...
-        await context.bot.send_message(
-            chat_id=Admin, text=message, parse_mode=ParseMode.HTML
-        )   
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends the initial Message to the user"""
@@ -160,18 +317,16 @@ async def check_userlist(UserID, context: ContextTypes.DEFAULT_TYPE) -> bool:
 
 async def save_to_jobstorage(assignment, context: ContextTypes.DEFAULT_TYPE):
     if context.bot_data.get("jobstorage") == None:
-        context.bot_data["jobstorage"] = []
-    context.bot_data["jobstorage"].append(assignment)
+        context.bot_data["jobstorage"] = {}
+    context.bot_data["jobstorage"][assignment.JobID] = assignment
     await context.application.persistence.update_bot_data(context.bot_data)
     
 
 async def delete_from_jobstorage(JobID, context: ContextTypes.DEFAULT_TYPE):
     if context.bot_data.get("jobstorage") != None:
-         for assignment in context.bot_data["jobstorage"]:
-            if assignment.JobID == JobID:
-                context.bot_data["jobstorage"].remove(assignment)
-                #await context.application.persistence.flush()
-                await context.application.persistence.update_bot_data(context.bot_data)
+        if context.bot_data["jobstorage"].pop(JobID, None) != None:
+            #await context.application.persistence.flush()
+            await context.application.persistence.update_bot_data(context.bot_data)
                 
 
 async def service(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -192,9 +347,8 @@ async def service(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif update.message.text == "🔄 Joblist":
         keyboard = []
         keyboard_list = []
-        for Job in context.job_queue.jobs():
-            if update.message.chat_id == Job.data.ChatID:
-                keyboard.append(InlineKeyboardButton(Job.data.Name, callback_data=Callback("select_job",Job.data.JobID)))
+        for Job in registry.of_chat(update.message.chat_id):
+            keyboard.append(InlineKeyboardButton(Job.data.Name, callback_data=Callback("select_job",Job.data.JobID)))
         if keyboard == []:
             await update.message.reply_text('No Jobs here, maybe you want to create one? /start')
             return SERVICE
@@ -220,27 +374,25 @@ async def service(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def joblist(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Processes the user input regarding the joblist"""
     user = update.message.from_user
-    for Job in context.job_queue.jobs():
+    for Job in registry.of_chat(update.message.chat_id):
         if update.message.text == Job.data.Name:
-            if update.message.chat_id == Job.data.ChatID:
-                await update.message.reply_text(
-                    'Details of Job "' + str(Job.data.Name) + '"\n\n'
-                    'Job ID: "' + str(Job.data.JobID) + '"\n\n'
-                    'Service: ' + str(Job.data.Service) + '\n\n'
-                    'Count: ' + str(Job.data.Statistics["count"]) + '\n\n' 
-                    '# of Alarms: ' + str(Job.data.Statistics["alarm"]) + '\n\n' )
-                logger.info('%s Job "%s" has been selected by User %s', str(Job.data.Service), str(Job.data.Name), user.full_name)
+            await update.message.reply_text(
+                'Details of Job "' + str(Job.data.Name) + '"\n\n'
+                'Job ID: "' + str(Job.data.JobID) + '"\n\n'
+                'Service: ' + str(Job.data.Service) + '\n\n'
+                'Count: ' + str(Job.data.Statistics.count) + '\n\n' 
+                '# of Alarms: ' + str(Job.data.Statistics.alarm) + '\n\n' )
+            logger.info('%s Job "%s" has been selected by User %s', str(Job.data.Service), str(Job.data.Name), user.full_name)
     return SERVICE
 
 def jobdelete(update: Update, context: CallbackContext):
     """Processes the user input to delete a job"""
     user = update.message.from_user
-    for Job in context.job_queue.jobs():
+    for Job in registry.of_chat(update.message.chat_id):
         if update.message.text == Job.data.Name:
-            if update.message.chat_id == Job.data.ChatID:
-                Job.schedule_removal()
-                update.message.reply_text("Job removed")
-                logger.info('%s Job "%s" has been removed by User %s', str(Job.data.Service), str(Job.data.Name), user.full_name)
+            unschedule_assignment(Job.data.JobID)
+            update.message.reply_text("Job removed")
+            logger.info('%s Job "%s" has been removed by User %s', str(Job.data.Service), str(Job.data.Name), user.full_name)
     update.message.reply_text(
         'Send /cancel to stop talking to me.\n\n'
         'What service do you need?',
@@ -260,7 +412,7 @@ async def suc_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     chat_id = update.message.chat_id
     logger.info("%s Link received from %s: %s", context.user_data['service'], user.full_name, update.message.text)
     try:
-        data = download(update.message.text)
+        data = await async_download(update.message.text)
         context.user_data['link'] = update.message.text
         context.user_data['name'] = update.message.text
     except:
@@ -278,7 +430,7 @@ async def suc_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     #update.message.reply_text('Now send me as many Sizes as you want and press /finish if you are done.')
     await update.message.reply_text(
         'Okay, Thanks! Now I need your Interval in Seconds',
-        reply_markup=ReplyKeyboardMarkup([["3","5","10","30","60","300","600","1800"]], one_time_keyboard=True, resize_keyboard=True, input_field_placeholder='Select Inteval' ))
+        reply_markup=ReplyKeyboardMarkup(interval_keyboard, one_time_keyboard=True, resize_keyboard=True, input_field_placeholder='Select Inteval' ))
 
     return SUC_INTERVAL
 
@@ -288,7 +440,7 @@ async def suc_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     chat_id = update.message.chat_id
     logger.info("Interval from %s: %s", user.full_name, update.message.text)
     try:
-        temp_interval = int(update.message.text)
+        temp_interval, temp_max_interval = parse_interval(update.message.text)
         a = Assignment(
             shortuuid.uuid(),
             chat_id,
@@ -297,10 +449,11 @@ async def suc_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             context.user_data['name'],
             context.user_data['link'],
             None,
-            "",
-            {"count": 0,"alarm": 0}
+            migrate_suc_state(""),
+            Statistics(),
+            Max_Interval=temp_max_interval
             )
-        context.job_queue.run_repeating(suc_alarm, interval=a.Interval, data=a, name=str(a.JobID))
+        schedule_assignment(context.job_queue, suc_alarm, a)
         await save_to_jobstorage(a, context)
         #b = context.bot_data.get("jobstorage")
         #print(b)
@@ -319,20 +472,30 @@ async def suc_alarm(context: ContextTypes.DEFAULT_TYPE) -> None:
     job = context.job
     
     try:
-        current_data = download(job.data.Link)
-        if current_data != job.data.Stored_Update:
-            if job.data.Statistics["count"] >= 1:
-                await context.bot.send_message(job.data.ChatID, text= "Update for " + job.data.Link)
-                job.data.Statistics["alarm"] += 1 
+        result = await run_check(suc_check, job.data)
+        if result.not_modified:
+            logger.info('%s Job "%s" found no Update. Page not modified.', str(job.data.Service), str(job.data.Link))
+            job.data.Statistics.count += 1
+            adapt_interval(job, False)
+            return
+        if result.changed:
+            if job.data.Statistics.count >= 1:
+                notifier.notify(job.data.ChatID, result.message)
+                job.data.Statistics.alarm += 1 
             logger.info('%s Job "%s" found Update.', str(job.data.Service), str(job.data.Link))
-            job.data.Stored_Update = current_data
-            job.data.Statistics["count"] += 1 
+            job.data.Stored_Update = result.Stored_Update
+            job.data.Statistics.count += 1 
+            adapt_interval(job, True)
             
         else:
             logger.info('%s Job "%s" found no Update.', str(job.data.Service), str(job.data.Link))
-            job.data.Statistics["count"] += 1 
+            job.data.Statistics.count += 1 
+            adapt_interval(job, False)
             
-    except:
+    except CircuitOpen as err:
+        logger.info('%s Job "%s" skipped: %s', str(job.data.Service), str(job.data.Link), str(err))
+    except Exception as err:
+        metrics.error(job.data.JobID, job.data.Link, err)
         logger.info("Check not Successful. Try again later.")
 
 """
@@ -347,7 +510,7 @@ async def sfs_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     #await update.message.reply_text(context.bot_data["jobstorage"].JobID)
     logger.info("%s Link received from %s: %s", context.user_data['service'], user.full_name, update.message.text)
     try:
-        data = download(update.message.text)
+        data = await async_download(update.message.text)
         context.user_data['link'] = update.message.text
     except:
         await update.message.reply_text("Something has gone terribly wrong. Maybe your link is not valid. Try again.")
@@ -363,20 +526,27 @@ async def sfs_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info('%s Link from %s is valid.', context.user_data['service'], user.full_name)
     #update.message.reply_text('Now send me as many Sizes as you want and press /finish if you are done.')
     await update.message.reply_text(
-        'Great! Now send me the exact term(s) you want to search for. You will be notified if there are any changes concerning your search term (eg. "Out of Stock" or "Add to Shopping Cart")')
+        'Great! Now send me the exact term(s) you want to search for, one per line. Wrap a term in slashes to use a regular expression (eg. /\\d+ left/). '
+        'You will be notified if there are any changes concerning your search terms (eg. "Out of Stock" or "Add to Shopping Cart")')
 
     return SFS_SEARCHTERM
 
 async def sfs_searchterm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Stores the searchterm provided by the user."""
     user = update.message.from_user
+    terms = parse_search_terms(update.message.text)
+    try:
+        term_matcher(terms)
+    except (re.error, ValueError) as err:
+        await update.message.reply_text('There was a problem with your search term(s): ' + str(err) + '. Try again.')
+        return SFS_SEARCHTERM
     
-    context.user_data['Searchterm'] = update.message.text
-    context.user_data['name'] = update.message.text + ' @ ' + context.user_data['link']
-    logger.info("Searchterm from %s is: %s", user.full_name, update.message.text)
+    context.user_data['Searchterm'] = terms
+    context.user_data['name'] = ' | '.join(terms) + ' @ ' + context.user_data['link']
+    logger.info("Searchterm from %s is: %s", user.full_name, str(terms))
     await update.message.reply_text(
             'Okay, Thanks! Now I need your Interval in Seconds',
-            reply_markup=ReplyKeyboardMarkup([["3","5","10","30","60","300","600","1800"]], one_time_keyboard=True, resize_keyboard=True, input_field_placeholder='Select Inteval' ))
+            reply_markup=ReplyKeyboardMarkup(interval_keyboard, one_time_keyboard=True, resize_keyboard=True, input_field_placeholder='Select Inteval' ))
     return SFS_INTERVAL
 
 async def sfs_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -385,7 +555,7 @@ async def sfs_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     chat_id = update.message.chat_id
     logger.info("Interval from %s: %s", user.full_name, update.message.text)
     try:
-        temp_interval = int(update.message.text)
+        temp_interval, temp_max_interval = parse_interval(update.message.text)
         a = Assignment(
             shortuuid.uuid(),
             chat_id,
@@ -394,12 +564,13 @@ async def sfs_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             context.user_data['name'],
             context.user_data['link'],
             context.user_data['Searchterm'],
-            bool,
-            {"count": 0,"alarm": 0}
+            None,
+            Statistics(),
+            Max_Interval=temp_max_interval
             )
-        context.job_queue.run_repeating(sfs_alarm, interval=a.Interval, data=a, name=str(a.JobID))
+        schedule_assignment(context.job_queue, sfs_alarm, a)
         await save_to_jobstorage(a, context)
-        tmp_msg = 'Searching for updates on "' + context.user_data['Searchterm'] + '" @ ' + context.user_data['link'] + ' every ' + str(update.message.text) + ' seconds.'
+        tmp_msg = 'Searching for updates on "' + '", "'.join(context.user_data['Searchterm']) + '" @ ' + context.user_data['link'] + ' every ' + str(update.message.text) + ' seconds.'
         await update.message.reply_text(tmp_msg)
 
     except (IndexError, ValueError):
@@ -412,26 +583,31 @@ async def sfs_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 async def sfs_alarm(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send the alarm message, if there is an Update"""
     job = context.job
-    Term_Present = bool
     try:
-        data = download(job.data.Link)
-        if data != None and job.data.Search_For in data:
-            Term_Present = True
-        else:
-            Term_Present = False
-        if Term_Present != job.data.Stored_Update:
-            if job.data.Statistics["count"] >= 1:
-                await context.bot.send_message(job.data.ChatID, text= "Update for " + job.data.Link)
-                job.data.Statistics["alarm"] += 1
+        result = await run_check(sfs_check, job.data)
+        if result.not_modified:
+            logger.info('%s Job "%s" found no Update. Page not modified.', str(job.data.Service), str(job.data.Link))
+            job.data.Statistics.count += 1
+            adapt_interval(job, False)
+            return
+        if result.changed:
+            if job.data.Statistics.count >= 1:
+                notifier.notify(job.data.ChatID, result.message)
+                job.data.Statistics.alarm += 1
             logger.info('%s Job "%s" found an Update.', str(job.data.Service), str(job.data.Link))
-            job.data.Stored_Update = Term_Present
-            job.data.Statistics["count"] += 1
+            job.data.Stored_Update = result.Stored_Update
+            job.data.Statistics.count += 1
+            adapt_interval(job, True)
             
         else:
             logger.info('%s Job "%s" found no Update.', str(job.data.Service), str(job.data.Link))
-            job.data.Statistics["count"] += 1
+            job.data.Statistics.count += 1
+            adapt_interval(job, False)
             
-    except:
+    except CircuitOpen as err:
+        logger.info('%s Job "%s" skipped: %s', str(job.data.Service), str(job.data.Link), str(err))
+    except Exception as err:
+        metrics.error(job.data.JobID, job.data.Link, err)
         logger.info("Check not Successful. Try again later.")
 
 """
@@ -446,7 +622,7 @@ async def sil_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     #await update.message.reply_text(context.bot_data["jobstorage"].JobID)
     logger.info("%s Link received from %s: %s", context.user_data['service'], user.full_name, update.message.text)
     try:
-        data = download(update.message.text)
+        data = await async_download(update.message.text)
         context.user_data['link'] = update.message.text
     except:
         await update.message.reply_text("Something has gone terribly wrong. Maybe your link is not valid. Try again.")
@@ -474,7 +650,7 @@ async def sil_searchterm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info("Searchterm from %s is: %s", user.full_name, update.message.text)
     await update.message.reply_text(
             'Okay, Thanks! Now I need your Interval in Seconds',
-            reply_markup=ReplyKeyboardMarkup([["3","5","10","30","60","300","600","1800"]], one_time_keyboard=True, resize_keyboard=True, input_field_placeholder='Select Inteval' ))
+            reply_markup=ReplyKeyboardMarkup(interval_keyboard, one_time_keyboard=True, resize_keyboard=True, input_field_placeholder='Select Inteval' ))
     return SIL_INTERVAL
 
 async def sil_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -483,7 +659,7 @@ async def sil_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     chat_id = update.message.chat_id
     logger.info("Interval from %s: %s", user.full_name, update.message.text)
     try:
-        temp_interval = int(update.message.text)
+        temp_interval, temp_max_interval = parse_interval(update.message.text)
         a = Assignment(
             shortuuid.uuid(),
             chat_id,
@@ -492,10 +668,11 @@ async def sil_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             context.user_data['name'],
             context.user_data['link'],
             context.user_data['Searchterm'],
-            [],
-            {"count": 0,"alarm": 0}
+            frozenset(),
+            Statistics(),
+            Max_Interval=temp_max_interval
             )
-        context.job_queue.run_repeating(sil_alarm, interval=a.Interval, data=a, name=str(a.JobID))
+        schedule_assignment(context.job_queue, sil_alarm, a)
         await save_to_jobstorage(a, context)
         tmp_msg = 'Searching for updates on "' + context.user_data['Searchterm'] + '" @ ' + context.user_data['link'] + ' every ' + str(update.message.text) + ' seconds.'
         await update.message.reply_text(tmp_msg)
@@ -511,59 +688,35 @@ async def sil_alarm(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send the alarm message if a new element is added to the HTML element identified by the given ID or first class occurrence."""
     job = context.job
     try:
-        # Download the HTML content from the link
-        response = download(job.data.Link, True)
-        if response.status_code != 200:
-            print("Failed to fetch the webpage "+job.data.Link+". Status: " + str(response.status_code))
-        #with open("a.html", 'r', encoding='utf-8') as html_file:
-        # html_content = html_file.read()
-        # Parse the HTML content using BeautifulSoup
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Try to find an element by ID first
-        target_element = soup.find(id=job.data.Search_For)
-        
-        if not target_element:
-            # If no element with the ID was found, try to find the first occurrence of the class
-            target_element = soup.find(class_=job.data.Search_For)
-        
-        if target_element:
-            # Get all child elements (direct children) within the target element
-            child_elements = target_element.find_all(recursive=False)  # Non-recursive, direct children
-            
-            # Extract unique content/identifiers of each element (e.g., its HTML or any other identifiable attribute)
-            current_element_list = [str(element) for element in child_elements]
-
-            # Remove any timestamps ('ts=[numbers]') from the list
-            cleaned_list = []
-            for element in current_element_list:
-                cleaned_element = re.sub(r'ts=\d+', '', element).strip()
-                cleaned_list.append(cleaned_element)
-            current_element_list = cleaned_list
-        else:
+        result = await run_check(sil_check, job.data)
+        if result.not_modified:
+            logger.info('%s Job "%s" found no new elements. Page not modified.', str(job.data.Service), str(job.data.Link))
+            job.data.Statistics.count += 1
+            adapt_interval(job, False)
+            return
+        if result.missing:
             logger.info("No element found with the specified ID or class.")
             return
 
-
-        new_elements = set(current_element_list) - set(job.data.Stored_Update)
-
-        if not new_elements:
+        if not result.changed:
             logger.info('%s Job "%s" found no new elements.', str(job.data.Service), str(job.data.Link))
         else: 
-            if job.data.Statistics["count"] >= 1:
-                await context.bot.send_message(
-                        job.data.ChatID, 
-                        text=f"Update for {job.data.Link}: New element(s) added to the list with ID or class {job.data.Search_For}"
-                    )
-                job.data.Statistics["alarm"] += 1
+            if job.data.Statistics.count >= 1:
+                notifier.notify(job.data.ChatID, result.message)
+                job.data.Statistics.alarm += 1
                 logger.info('%s Job "%s" found an update: New elements added to the list.', str(job.data.Service), str(job.data.Link))
             else:
                 logger.info("Initialized element set for the first time.")
 
 
-        job.data.Stored_Update = current_element_list
-        job.data.Statistics["count"] += 1
+        if result.Stored_Update != job.data.Stored_Update:
+            job.data.Stored_Update = result.Stored_Update
+        job.data.Statistics.count += 1
+        adapt_interval(job, result.changed)
+    except CircuitOpen as err:
+        logger.info('%s Job "%s" skipped: %s', str(job.data.Service), str(job.data.Link), str(err))
     except Exception as e:
+        metrics.error(job.data.JobID, job.data.Link, e)
         logger.info("Check of " +str(job.data.Link)+" not successful. Error: %s. Try again later.", str(e))
 
 
@@ -575,15 +728,14 @@ async def link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Stores the Link provided by the user."""
     user = update.message.from_user
     chat_id = update.message.chat_id
-    data = download_zalando_json(update.message.text)
     logger.info("%s Link received from %s: %s", context.user_data['service'], user.full_name, update.message.text)
 
     try:
-        available_sizes = parse_available_sizes(data)
-        all_sizes = parse_all_sizes(data)
-        soldout_sizes = find_soldout_items(all_sizes, available_sizes)
+        snapshot = await async_download_zalando_snapshot(update.message.text)
+        all_sizes = list(snapshot.All_Sizes)
+        soldout_sizes = snapshot.soldout_sizes()
         context.user_data['link'] = update.message.text
-        context.user_data['name'] = str(parse_name(data))
+        context.user_data['name'] = snapshot.full_name()
         await update.message.reply_text(
             "I've checked your link and... everything checks out.\nThese are the sizes that are potentially available:" + str(all_sizes)+
             "\nThese are the sizes that are currenty sold-out: "+str(soldout_sizes))
@@ -624,7 +776,7 @@ async def sizes_done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     chat_id = update.message.chat_id
     await update.message.reply_text(
         'Okay, Thanks! Now I need your Interval in Seconds',
-        reply_markup=ReplyKeyboardMarkup([["3","5","10","30","60","300","600","1800"]], one_time_keyboard=True, resize_keyboard=True, input_field_placeholder='Select Inteval' ))
+        reply_markup=ReplyKeyboardMarkup(interval_keyboard, one_time_keyboard=True, resize_keyboard=True, input_field_placeholder='Select Inteval' ))
     return INTERVAL
 
 async def interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -633,7 +785,7 @@ async def interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     chat_id = update.message.chat_id
     logger.info("Interval from %s: %s", user.full_name, update.message.text)
     try:
-        temp_interval = int(update.message.text)
+        temp_interval, temp_max_interval = parse_interval(update.message.text)
         a = Assignment(
             shortuuid.uuid(),
             chat_id,
@@ -642,11 +794,12 @@ async def interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             context.user_data['name'],
             context.user_data['link'],
             context.user_data['sizes'],
-            [],
-            {"count": 0,"alarm": 0}
+            (),
+            Statistics(),
+            Max_Interval=temp_max_interval
             )
         
-        context.job_queue.run_repeating(alarm, interval=a.Interval, data=a, name=str(a.JobID))
+        schedule_assignment(context.job_queue, alarm, a)
         await save_to_jobstorage(a, context)
         await update.message.reply_text('Searching for "'+context.user_data['name']+'" in Size(s) ' + str(context.user_data['sizes']) + ' every ' + str(update.message.text) + ' seconds.')
 
@@ -670,9 +823,8 @@ async def joblist_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if query.data.Operation == "back_to_joblist":
         keyboard = []
         keyboard_list = []
-        for Job in context.job_queue.jobs():
-            if user.id == Job.data.ChatID:
-                keyboard.append(InlineKeyboardButton(Job.data.Name, callback_data=Callback("select_job",Job.data.JobID)))
+        for Job in registry.of_chat(user.id):
+            keyboard.append(InlineKeyboardButton(Job.data.Name, callback_data=Callback("select_job",Job.data.JobID)))
         if keyboard == []:
             await query.edit_message_text('No Jobs here, maybe you want to create one?', reply_markup=ReplyKeyboardMarkup(
             service_keyboard, one_time_keyboard=True, resize_keyboard=True, input_field_placeholder='Select checking Service'))
@@ -684,31 +836,31 @@ async def joblist_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return JOBLIST
     
     if query.data.Operation  == "select_job":
-        for Job in context.job_queue.jobs():
-            if query.data.Parameter == Job.data.JobID:
-                if user.id == Job.data.ChatID:
-                    keyboard = [
-                        InlineKeyboardButton("Back to Joblist", callback_data=Callback("back_to_joblist")),
-                        InlineKeyboardButton("Delete Job", callback_data=Callback("delete", Job.data.JobID))
-                        ]
-                    await query.edit_message_text(
-                        '⚙️ Details of Job "' + str(Job.data.Name) + '"\n\n'
-                        '🗂️ Job ID: "' + str(Job.data.JobID) + '"\n\n'
-                        '📠 Service: ' + str(Job.data.Service) + '\n\n'
-                        '⏲️ Interval: ' + str(Job.data.Interval) + " Seconds" + '\n\n'
-                        '🔁 Count: ' + str(Job.data.Statistics["count"]) + '\n\n' 
-                        '🚨 # of Alarms: ' + str(Job.data.Statistics["alarm"]) + '\n\n',
-                        reply_markup=InlineKeyboardMarkup(build_menu(keyboard,n_cols=1)))
-                    logger.info('%s Job "%s" has been selected by User %s', str(Job.data.Service), str(Job.data.Name), user.full_name)
+        Job = registry.get(query.data.Parameter)
+        if Job != None:
+            if user.id == Job.data.ChatID:
+                keyboard = [
+                    InlineKeyboardButton("Back to Joblist", callback_data=Callback("back_to_joblist")),
+                    InlineKeyboardButton("Delete Job", callback_data=Callback("delete", Job.data.JobID))
+                    ]
+                await query.edit_message_text(
+                    '⚙️ Details of Job "' + str(Job.data.Name) + '"\n\n'
+                    '🗂️ Job ID: "' + str(Job.data.JobID) + '"\n\n'
+                    '📠 Service: ' + str(Job.data.Service) + '\n\n'
+                    '⏲️ Interval: ' + interval_text(Job.data) + '\n\n'
+                    '🔁 Count: ' + str(Job.data.Statistics.count) + '\n\n' 
+                    '🚨 # of Alarms: ' + str(Job.data.Statistics.alarm) + '\n\n',
+                    reply_markup=InlineKeyboardMarkup(build_menu(keyboard,n_cols=1)))
+                logger.info('%s Job "%s" has been selected by User %s', str(Job.data.Service), str(Job.data.Name), user.full_name)
 
     if query.data.Operation == "delete":
-        for Job in context.job_queue.jobs():
-            if query.data.Parameter == Job.data.JobID:
-                if user.id == Job.data.ChatID:
-                    await delete_from_jobstorage(Job.data.JobID, context)
-                    Job.schedule_removal()
-                    await query.edit_message_text("Job removed.")
-                    logger.info('%s Job "%s" has been removed by User %s', str(Job.data.Service), str(Job.data.Name), user.full_name)
+        Job = registry.get(query.data.Parameter)
+        if Job != None:
+            if user.id == Job.data.ChatID:
+                await delete_from_jobstorage(Job.data.JobID, context)
+                unschedule_assignment(Job.data.JobID)
+                await query.edit_message_text("Job removed.")
+                logger.info('%s Job "%s" has been removed by User %s', str(Job.data.Service), str(Job.data.Name), user.full_name)
         await query.message.reply_text(
             'Send /cancel to stop talking to me.\n\n'
             'What service do you need?',
@@ -750,24 +902,111 @@ async def cancel(update: Update, context: CallbackContext):
     return ConversationHandler.END
 
 async def initialize_queue(application: Application):
+    global metrics_server, worker_pool, coordinator
+    notifier.start(application.bot)
+    if WORKER_PROCESSES:
+        worker_pool = WorkerPool(WORKER_PROCESSES)
+        worker_pool.start()
+        logger.info("Started %s worker processes for the checks", WORKER_PROCESSES)
+    application.job_queue.run_repeating(send_error_digest, interval=ERROR_DIGEST_INTERVAL, first=ERROR_DIGEST_INTERVAL, name="error_digest")
+    if METRICS_PORT:
+        metrics_server = await serve_metrics(METRICS_HOST, METRICS_PORT, collect_metrics)
+        logger.info("Metrics served on http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
     print(application.bot_data.get("jobstorage"))
     if application.bot_data.get("jobstorage") != None:
         logger.info("Initializion started")  
-        for assignment in application.bot_data["jobstorage"]:
-            if assignment.Service == "🔄 Zalando":
-                application.job_queue.run_repeating(alarm, interval=assignment.Interval, data=assignment, name=str(assignment.JobID))
-                logger.info("Initialized JobID " + assignment.JobID)
-            if assignment.Service == "🔄 Simple Update Check":
-                application.job_queue.run_repeating(suc_alarm, interval=assignment.Interval, data=assignment, name=str(assignment.JobID))
-                logger.info("Initialized JobID " + assignment.JobID)
-            if assignment.Service == "🔄 Search for ...":
-                application.job_queue.run_repeating(sfs_alarm, interval=assignment.Interval, data=assignment, name=str(assignment.JobID))
-                logger.info("Initialized JobID " + assignment.JobID)
-            if assignment.Service == "🔄 Search in List":
-                application.job_queue.run_repeating(sil_alarm, interval=assignment.Interval, data=assignment, name=str(assignment.JobID))
-                logger.info("Initialized JobID " + assignment.JobID)
+        for assignment in application.bot_data["jobstorage"].values():
+            initialize_assignment(application.job_queue, assignment)
     else:
         logger.info("Initializion failed, no jobstorage found")
+    if SHARD_NODE is not None:
+        coordinator = SqliteCoordinator(SHARD_COORDINATOR, SHARD_NODE, timeout=3 * SHARD_HEARTBEAT)
+        # Rows of assignments another node holds the claim for are written by that node only
+        application.persistence.owned = owned_jobs
+        application.job_queue.run_repeating(rebalance, interval=SHARD_HEARTBEAT, first=0, name="rebalance")
+        logger.info("Checking as node %s, coordinated through %s", SHARD_NODE, SHARD_COORDINATOR)
+
+def initialize_assignment(job_queue, assignment):
+    """Brings a stored assignment to the current format and schedules its job"""
+    if assignment.Service == "🔄 Zalando":
+        assignment.Stored_Update = migrate_zalando_state(assignment.Stored_Update)
+        schedule_assignment(job_queue, alarm, assignment, stagger=True)
+        logger.info("Initialized JobID " + assignment.JobID)
+    if assignment.Service == "🔄 Simple Update Check":
+        assignment.Stored_Update = migrate_suc_state(assignment.Stored_Update)
+        schedule_assignment(job_queue, suc_alarm, assignment, stagger=True)
+        logger.info("Initialized JobID " + assignment.JobID)
+    if assignment.Service == "🔄 Search for ...":
+        assignment.Search_For, assignment.Stored_Update = migrate_sfs_state(assignment.Search_For, assignment.Stored_Update)
+        schedule_assignment(job_queue, sfs_alarm, assignment, stagger=True)
+        logger.info("Initialized JobID " + assignment.JobID)
+    if assignment.Service == "🔄 Search in List":
+        assignment.Stored_Update = migrate_sil_state(assignment.Stored_Update)
+        schedule_assignment(job_queue, sil_alarm, assignment, stagger=True)
+        logger.info("Initialized JobID " + assignment.JobID)
+
+async def rebalance(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Picks up assignments other nodes added or deleted, then claims the assignments the hash ring gives this node and hands over the others.
+    An assignment is only claimed after its former node released it (or stopped), so it is never checked by two nodes."""
+    application = context.application
+    persistence = application.persistence
+    jobstorage = application.bot_data["jobstorage"]
+    await application.update_persistence()
+    stored = persistence.stored_job_ids()
+    for JobID in jobstorage.keys() - stored:
+        unschedule_assignment(JobID)
+        del jobstorage[JobID]
+        owned_jobs.discard(JobID)
+    added = stored - jobstorage.keys()
+    if added:
+        for JobID, assignment in persistence.read_assignments(added).items():
+            persistence.mark_written(assignment)
+            jobstorage[JobID] = assignment
+            initialize_assignment(context.job_queue, assignment)
+
+    # Claims another node took over after missed heartbeats are not ours anymore
+    owned_jobs.intersection_update(coordinator.heartbeat())
+    ring = HashRing(coordinator.live_nodes())
+    wanted = {JobID for JobID, assignment in jobstorage.items() if ring.owner(shard_key(assignment, SHARD_BY)) == coordinator.node}
+    released = owned_jobs - wanted
+    if released:
+        handing_over.update(released)
+        await asyncio.gather(*[done for JobID in released for done in running_checks.get(JobID, ())])
+        # The next node reads the state of the assignments when it claims them
+        await application.update_persistence()
+        owned_jobs.difference_update(released)
+        handing_over.difference_update(released)
+        coordinator.release(released)
+        logger.info("Handed over %s assignments", len(released))
+    claimed = coordinator.claim(wanted - owned_jobs)
+    if not claimed:
+        return
+    # The former node may have found updates since this node read the assignments
+    assignments = persistence.read_assignments(claimed)
+    coordinator.release(claimed - assignments.keys())
+    for JobID, assignment in assignments.items():
+        persistence.mark_written(assignment)
+        previous = jobstorage[JobID]
+        jobstorage[JobID] = assignment
+        job = registry.get(JobID)
+        if job is not None:
+            job.data = assignment
+            if effective_interval(assignment) != effective_interval(previous):
+                job.job.reschedule(trigger="interval", seconds=effective_interval(assignment), jitter=effective_interval(assignment) * JITTER_RATIO)
+        owned_jobs.add(JobID)
+    logger.info("Took over %s assignments", len(assignments))
+
+async def shutdown(application: Application):
+    """Stops the workers, sends the queued alarms and closes the shared HTTP client of the download path."""
+    if worker_pool is not None:
+        await worker_pool.close()
+    await notifier.close()
+    await close_client()
+    if metrics_server is not None:
+        metrics_server.close()
+    if coordinator is not None:
+        coordinator.leave()
+        coordinator.close()
              
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Exception while handling an update:", exc_info=context.error)
@@ -795,14 +1034,22 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def admin(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.message.chat_id == Admin:
+        collected = await collect_diagnostics()
         message = (
                 f"<pre>▫️▫️▫️ HELLO ADMIN ▫️▫️▫️\n\n"
                 f"Bot Data\n"
                 f"context.bot_data = {html.escape(str(context.bot_data.get('jobstorage')))}\n\n"
                 f"Job queue = {html.escape(str(context.job_queue.jobs()))}\n\n"
-                f"Userlist = {html.escape(str(context.bot_data.get('userlist')))}</pre>\n\n"
+                f"Userlist = {html.escape(str(context.bot_data.get('userlist')))}\n\n"
+                f"Conditional GET = {html.escape(conditional_statistics(collected['conditional']))}\n\n"
+                f"Host queues = {html.escape(host_statistics(collected['queues']))}\n\n"
+                f"Connections = {html.escape(connection_statistics(collected['connections']))}\n\n"
+                f"Paused hosts = {html.escape(circuit_summary(collected['paused_hosts']))}\n\n"
+                f"Paused jobs = {html.escape(job_breaker.summary())}\n\n"
+                f"Notifications = {html.escape(notifier.summary())}\n\n"
+                f"Checker nodes = {html.escape(coordinator.summary() if coordinator is not None else 'not sharded')}</pre>\n\n"
             )
-        for assignment in context.bot_data["jobstorage"]:
+        for assignment in context.bot_data["jobstorage"].values():
             message = message + f"<pre>ASSIGNMENT ID = {html.escape(str(assignment.JobID))}\n"
             message = message + f"--> Name: = {html.escape(str(assignment.Name))}\n"
             message = message + f"--> ChatID: = {html.escape(str(assignment.ChatID))}\n"
@@ -815,17 +1062,91 @@ async def admin(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         message = message + f"🗑️ Delete job from queue & jobstorage: <pre>/admin_delete [JobID/ChatID]</pre>\n"
         message = message + f"🆗 Whitelist user:<pre>/admin_join [UserID]</pre>\n"
         message = message + f"💬 Message to user:<pre>/admin_message [UserID/userlist] [Message]</pre>\n"
+        message = message + f"📈 Slowest jobs & costliest hosts:<pre>/admin_stats [Count]</pre>\n"
+        message = message + f"🔬 Profile checks:<pre>/admin_profile [Seconds/checks Count/stop] [JobID/Service]</pre>\n"
         if len(message) > 4096:   
                 a = str(a)[0:4095]
         await context.bot.send_message(chat_id=Admin, text=message, parse_mode=ParseMode.HTML)
     else:
         await update.message.reply_text('You are not Admin, disregarding request.')
 
+def series_text(series):
+    """Summarizes the metrics of one job or host"""
+    text = (f"fetch p50 {series.fetch.quantile(0.5):g} s, p95 {series.fetch.quantile(0.95):g} s, max {series.fetch.max:.2f} s, "
+            f"parse p95 {series.parse.quantile(0.95):g} s, {series.bytes / 1024 / 1024:.1f} MB in {series.fetch.count} responses")
+    if series.statuses:
+        text += ", status " + " ".join(f"{status}×{count}" for status, count in sorted(series.statuses.items()))
+    if series.errors:
+        text += ", errors " + " ".join(f"{error}×{count}" for error, count in sorted(series.errors.items()))
+    if series.connections:
+        text += f", {series.connections} connections, {series.handshakes} TLS handshakes"
+    return text
+
+async def admin_stats(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows the slowest jobs and the hosts that cost the most"""
+    if update.message.chat_id == Admin:
+        n = int(context.args[0]) if context.args and context.args[0].isdigit() else 5
+        collected = await collect_metrics()
+        message = f"<pre>▫️▫️▫️ SLOWEST JOBS ▫️▫️▫️</pre>\n"
+        for JobID, series in collected.slowest_jobs(n):
+            Job = registry.get(JobID)
+            name = Job.data.Link if Job != None else "deleted"
+            message = message + f"<pre>{html.escape(str(JobID))} ({html.escape(str(name))})\n--> {html.escape(series_text(series))}</pre>\n"
+        message = message + f"\n<pre>▫️▫️▫️ COSTLIEST HOSTS ▫️▫️▫️</pre>\n"
+        for host, series in collected.costliest_hosts(n):
+            message = message + f"<pre>{html.escape(host)}\n--> {html.escape(series_text(series))}</pre>\n"
+        if len(message) > 4096:
+            message = message[0:4080] + "</pre>"
+        await context.bot.send_message(chat_id=Admin, text=message, parse_mode=ParseMode.HTML)
+    else:
+        await update.message.reply_text('You are not Admin, disregarding request.')
+
+async def send_profile(summary, path):
+    """Sends the summary of a finished profile to the Admin"""
+    if len(summary) > 3800:
+        summary = summary[0:3800]
+    await notifier.send(Admin, f"<pre>{html.escape(summary)}</pre>\nFull report: {html.escape(path)}", parse_mode=ParseMode.HTML)
+
+async def admin_profile(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Profiles the checks for some seconds or a number of checks, optionally only of one JobID or Service"""
+    if update.message.chat_id == Admin:
+        args = list(context.args)
+        if args and args[0] == "stop":
+            if profiler.session == None:
+                await update.message.reply_text('No profile running.')
+            else:
+                await profiler.finish()
+            return
+        if profiler.session != None:
+            await update.message.reply_text('A profile is already running, send /admin_profile stop to end it.')
+            return
+        if worker_pool is not None:
+            # The profiler samples the event loop of this process, which only waits for the workers
+            await update.message.reply_text('Profiling is unavailable while the checks run in worker processes, set WORKER_PROCESSES = 0 to profile them.')
+            return
+        seconds, checks = 60, None
+        if args and args[0] == "checks":
+            args.pop(0)
+            checks = int(args.pop(0)) if args and args[0].isdigit() else 100
+            seconds = None
+        elif args and args[0].isdigit():
+            seconds = int(args.pop(0))
+        match, description = None, "all checks"
+        if args:
+            target = " ".join(args)
+            match = lambda assignment: assignment.JobID == target or target.lower() in assignment.Service.lower()
+            description = f'checks of "{target}"'
+        profiler.start(send_profile, match, description, seconds=seconds, checks=checks)
+        await update.message.reply_text(f'Profiling {description} for ' + (f'{seconds} seconds.' if seconds else f'{checks} checks.'))
+        logger.info("Admin started profiling %s", description)
+    else:
+        await update.message.reply_text('You are not Admin, disregarding request.')
+
 async def admin_purge(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.message.chat_id == Admin:
         if len(context.args) >= 1:
             if context.args[0] == "jobstorage":
-                context.bot_data["jobstorage"] = []
+                context.bot_data["jobstorage"] = {}
                 await context.application.persistence.update_bot_data(context.bot_data)
                 # context.args[0]
                 message = (
@@ -834,8 +1155,10 @@ async def admin_purge(update: object, context: ContextTypes.DEFAULT_TYPE) -> Non
                     )
                 await context.bot.send_message(chat_id=Admin, text=message, parse_mode=ParseMode.HTML)
             elif context.args[0] == "queue":
-                for Job in context.job_queue.jobs():
+                # Only the assignment jobs, the error digest and the rebalance heartbeat keep running
+                for Job in list(registry.jobs.values()):
                     Job.schedule_removal()
+                registry.clear()
                 await update.message.reply_text('Queue deleted.')
             elif context.args[0] == "userlist":
                 context.bot_data["userlist"] = []
@@ -851,15 +1174,16 @@ async def admin_purge(update: object, context: ContextTypes.DEFAULT_TYPE) -> Non
 async def admin_delete(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.message.chat_id == Admin:
         if len(context.args) >= 1:
-            for Job in context.job_queue.jobs():
-                if context.args[0] == Job.data.JobID:
-                    await delete_from_jobstorage(Job.data.JobID, context)
-                    Job.schedule_removal()
-                    await update.message.reply_text('Deleted: ' + Job.data.JobID )
-                    logger.info("Admin deleted JobID " + Job.data.JobID)
-                elif context.args[0] == str(Job.data.ChatID):
+            Job = registry.get(context.args[0])
+            if Job != None:
+                await delete_from_jobstorage(Job.data.JobID, context)
+                unschedule_assignment(Job.data.JobID)
+                await update.message.reply_text('Deleted: ' + Job.data.JobID )
+                logger.info("Admin deleted JobID " + Job.data.JobID)
+            elif context.args[0].lstrip("-").isdigit():
+                for Job in registry.of_chat(int(context.args[0])):
                     await delete_from_jobstorage(Job.data.JobID, context)
-                    Job.schedule_removal()
+                    unschedule_assignment(Job.data.JobID)
                     await update.message.reply_text('Deleted via ChatID: ' + Job.data.JobID )
                     logger.info("Admin deleted JobID " + Job.data.JobID)
         else:
@@ -872,14 +1196,17 @@ async def admin_message(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         if len(context.args) >= 2:
             if context.args[0] == "userlist":
                 a = " ".join(context.args[1:])
-                for i in context.bot_data["userlist"]:
-                    await context.bot.send_message(chat_id=i, text=a)
-                    await update.message.reply_text(f'Message sent via Userlist to {i}.')
-                    logger.info(f'Admin sent Message to Userlist.')
+                userlist = list(context.bot_data["userlist"])
+                sent = await notifier.broadcast(userlist, a)
+                await update.message.reply_text(f'Message sent via Userlist to {sent} of {len(userlist)} users.')
+                logger.info(f'Admin sent Message to Userlist.')
             else:
-                await context.bot.send_message(chat_id=context.args[0], text=" ".join(context.args[1:]))
-                await update.message.reply_text(f'Message sent to {context.args[0]}.')
-                logger.info(f'Admin sent Message to User {context.args[0]}.')
+                if await notifier.send(context.args[0], " ".join(context.args[1:])):
+                    await update.message.reply_text(f'Message sent to {context.args[0]}.')
+                    logger.info(f'Admin sent Message to User {context.args[0]}.')
+                else:
+                    # The reason was logged by the notifier
+                    await update.message.reply_text(f'Message to {context.args[0]} could not be delivered, see the log.')
         else:
             await update.message.reply_text('Parameters not given')
     else:
@@ -898,15 +1225,41 @@ async def admin_join(update: object, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.message.reply_text('You are not Admin, disregarding request.')
 
 
+async def run_checker(application: Application):
+    """Runs the jobs without polling for updates until SIGINT or SIGTERM, for checker nodes next to the bot"""
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    await stop.wait()
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+
 def main() -> None:
     """Run the bot."""
-    persistence = PicklePersistence(filepath="bot_storage", update_interval=60)
+    global SHARD_NODE
+    parser = argparse.ArgumentParser(description="Telegram bot that checks websites for updates")
+    parser.add_argument("--node", help="name of this checker node, checks only its share of the assignments")
+    parser.add_argument("--checker", action="store_true", help="only run checks, another process with --node runs the bot")
+    args = parser.parse_args()
+    if args.checker and not args.node:
+        parser.error("--checker needs --node")
+    SHARD_NODE = args.node or SHARD_NODE
+    # Assignments, statistics and userlist are stored row by row, the former pickle file is imported once
+    # Checker nodes do not handle updates, so they leave the chat, user and callback data to the bot
+    persistence = SqlitePersistence(
+        filepath="bot_storage.sqlite", legacy_filepath="bot_storage", update_interval=60,
+        store_data=PersistenceInput(chat_data=False, user_data=False, callback_data=False) if args.checker else None)
     # Create the Application and pass it your bot's token.
     # Saved queue data can only be restored after the Application was initialized
     application = (
         Application.builder()
         .token(Token)
         .post_init(initialize_queue) 
+        .post_shutdown(shutdown)
         .persistence(persistence)
         .arbitrary_callback_data(True)
         .read_timeout(7)
@@ -942,6 +1295,8 @@ def main() -> None:
         fallbacks=[CommandHandler('cancel', cancel),
                    CommandHandler('start', start),
                    CommandHandler('admin', admin),
+                   CommandHandler('admin_stats', admin_stats),
+                   CommandHandler('admin_profile', admin_profile),
                    CommandHandler('admin_purge', admin_purge),
                    CommandHandler('admin_delete', admin_delete),
                    CommandHandler('admin_message', admin_message),
@@ -956,6 +1311,9 @@ def main() -> None:
     
     # Start the Bot
     
+    if args.checker:
+        asyncio.run(run_checker(application))
+        return
     application.run_polling(allowed_updates=Update.ALL_TYPES)
      
     # Run the bot until you press Ctrl-C or the process receives SIGINT,
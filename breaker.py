@@ -0,0 +1,93 @@
+import time
+
+# Consecutive failures that open a circuit
+FAILURE_THRESHOLD = 3
+# Seconds the first opening pauses the requests, every failed probe doubles the pause up to MAX_BACKOFF
+BASE_BACKOFF = 30
+MAX_BACKOFF = 3600
+
+
+class CircuitOpen(Exception):
+  """Raised instead of a request while the circuit of its host or job is open"""
+  def __init__(self, key, seconds):
+    super().__init__(key, seconds)
+    self.key = key
+    self.seconds = seconds
+
+  def __str__(self):
+    return f"{self.key} is paused for {self.seconds:.0f} more seconds"
+
+
+class Circuit:
+  """Failure state of one host or job. Closed while openings is 0, otherwise open until retry_at."""
+  __slots__ = ("failures", "openings", "retry_at", "probing")
+
+  def __init__(self):
+    self.failures = 0
+    self.openings = 0
+    self.retry_at = 0.0
+    self.probing = False
+
+
+class CircuitBreaker:
+  """Circuit breakers by key (a host or a JobID).
+  After threshold consecutive failures the circuit opens and requests fail fast with CircuitOpen.
+  Once the pause is over, one probe request is let through (half-open): it closes the circuit or reopens it for twice as long."""
+  def __init__(self, threshold=FAILURE_THRESHOLD, base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF):
+    self.threshold = threshold
+    self.base_backoff = base_backoff
+    self.max_backoff = max_backoff
+    self.circuits = {}
+
+  def acquire(self, key):
+    """Raises CircuitOpen while the circuit of the key is open, otherwise lets the request through"""
+    circuit = self.circuits.get(key)
+    if circuit is None or not circuit.openings:
+      return
+    now = time.monotonic()
+    if now < circuit.retry_at:
+      raise CircuitOpen(key, circuit.retry_at - now)
+    # The probe holds the circuit for one base pause, so a probe that never reports does not block it forever
+    circuit.probing = True
+    circuit.retry_at = now + self.base_backoff
+
+  def success(self, key):
+    """Closes the circuit of the key. Returns True if it was open."""
+    circuit = self.circuits.pop(key, None)
+    return circuit is not None and circuit.openings > 0
+
+  def failure(self, key):
+    """Records a failure. Returns the seconds the circuit was opened for, 0 if it is not (re)opened."""
+    circuit = self.circuits.setdefault(key, Circuit())
+    circuit.failures += 1
+    if circuit.openings and not circuit.probing:
+      # Requests that started before the circuit opened do not extend the pause
+      return 0
+    if not circuit.openings and circuit.failures < self.threshold:
+      return 0
+    circuit.openings += 1
+    circuit.probing = False
+    seconds = min(self.base_backoff * 2 ** (circuit.openings - 1), self.max_backoff)
+    circuit.retry_at = time.monotonic() + seconds
+    return seconds
+
+  def forget(self, key):
+    self.circuits.pop(key, None)
+
+  def open_circuits(self):
+    """Returns (key, remaining seconds, failures) of the open circuits, longest pause first"""
+    now = time.monotonic()
+    entries = [(key, max(circuit.retry_at - now, 0), circuit.failures) for key, circuit in self.circuits.items() if circuit.openings]
+    return sorted(entries, key=lambda entry: entry[1], reverse=True)
+
+  def summary(self):
+    """Returns a short summary of the open circuits"""
+    return circuit_summary(self.open_circuits())
+
+
+def circuit_summary(entries):
+    """Returns a short summary of open circuits given as (key, remaining seconds, failures), longest pause first"""
+    if not entries:
+        return "none open"
+    return ", ".join(f"{key}: {seconds:.0f} s ({failures} failures)" for key, seconds, failures in entries[:10]) + (
+        f" and {len(entries) - 10} more" if len(entries) > 10 else "")
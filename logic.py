@@ -1,8 +1,93 @@
-from typing import List
+from typing import List, NamedTuple, Optional
+import argparse
+import asyncio
+import functools
+import difflib
+import hashlib
+import time
+import zlib
+from contextlib import asynccontextmanager
 import requests
+import httpx
 import json
+import re
+import sys
 from requests.exceptions import HTTPError
 from fake_http_header import FakeHttpHeader
+from bs4 import BeautifulSoup, SoupStrainer
+from metrics import Metrics, metrics
+from breaker import CircuitBreaker, CircuitOpen
+try:
+    import lxml
+except ImportError:
+    lxml = None
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+# Settings of the shared HTTP client used by the async download path
+CONNECT_TIMEOUT = 5
+REQUEST_TIMEOUT = 15
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 30
+# Concurrent checks of a shop share multiplexed HTTP/2 connections if the "h2" package is installed.
+# Hosts without HTTP/2 (and plain http Links) are requested with HTTP/1.1.
+HTTP2 = True
+# Jobs watching the same Link share one download: a caller reuses a response younger than its max_age, by default this many seconds.
+# Recent responses are kept up to RECENT_BYTES of content, the oldest make room first.
+FRESHNESS_WINDOW = 3
+RECENT_BYTES = 64 * 1024 * 1024
+# Downloads of larger bodies are aborted
+MAX_BODY_BYTES = 10 * 1024 * 1024
+# Leaving an HTTP/1.1 response early closes its connection, so after the markers up to this many bytes are still read to keep it
+EARLY_STOP_DRAIN = 256 * 1024
+
+_client = None
+_inflight = {}
+_recent = {}
+_recent_bytes = 0
+# Longest max_age a caller asked for
+_recent_age = FRESHNESS_WINDOW
+
+# Number of generated browser headers, every host keeps one of them until they are regenerated after HEADER_POOL_REFRESH seconds
+HEADER_POOL_SIZE = 16
+HEADER_POOL_REFRESH = 3600
+
+# Politeness limits per host: concurrent requests, request rate and length of the waiting line
+HOST_MAX_IN_FLIGHT = 4
+HOST_REQUESTS_PER_SECOND = 2
+HOST_MAX_QUEUE = 200
+
+# Markers around the product JSON embedded in Zalando pages
+ZALANDO_START = '{"data":{"customer":{"sizeProfile'
+ZALANDO_END = '},"errors":['
+
+# HTML parser of Search in List: "lxml" (C based, used if installed) or "html.parser"
+SIL_PARSER = "lxml"
+# Only build the tree of the element with the searched ID or class instead of the whole page
+SIL_TARGETED = True
+# Rules (pattern, replacement) applied to the HTML of every list element before it is fingerprinted
+SIL_NORMALIZATION_RULES = [(r'ts=\d+', '')]
+_compiled_rules = {}
+
+# Number of concurrent checks of check_zalando_batch
+BATCH_WORKERS = 16
+
+# Conditional GET cache: validators per Link, the version counter per Link and the Link and version each caller has evaluated
+NOT_MODIFIED = object()
+CONDITIONAL_STATS = {"requests": 0, "not_modified": 0, "bytes_saved": 0}
+_validators = {}
+_versions = {}
+_seen = {}
+
+# Connections opened by the shared client and responses per HTTP version, the other responses reused a connection
+CONNECTION_STATS = {"connections": 0, "tls_handshakes": 0, "responses": 0, "HTTP/1.1": 0, "HTTP/2": 0}
+
+# Simple Update Check keeps only a digest of the page, plus a compressed snapshot if diffs are wanted
+SUC_KEEP_SNAPSHOT = False
+SUC_DIFF_LINES = 10
 
 
 def download(URL, asRawResponse=False):
@@ -10,9 +95,8 @@ def download(URL, asRawResponse=False):
     try:
         #header = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'} 
         #header = {'User-Agent': 'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Mobile Safari/537.36'}
-        fake_header = FakeHttpHeader(domain_name = 'de')
-        fake_header_dict = fake_header.as_header_dict()
-        response = requests.get(URL, headers=fake_header_dict )
+        fake_header_dict = header_pool.headers(httpx.URL(URL).host)
+        response = requests.get(URL, headers=fake_header_dict, timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT))
         # If the response was successful, no Exception will be raised
         response.raise_for_status()
         
@@ -28,9 +112,441 @@ def download(URL, asRawResponse=False):
             txt = response.content.decode("utf-8") 
             return txt
 
-def download_zalando_json(URL):
-    """Downloads the given Zalando Link and locates the relevant JSON Data. Returns JSON Data ready to parse."""
-    txt = download(URL)
+class HostLimitExceeded(Exception):
+  """Raised if too many requests to one host are already waiting"""
+
+
+class HostScheduler:
+  """Limits concurrent requests and requests per second for each host. 
+  Requests beyond the limits wait in line, a full line rejects further requests."""
+  def __init__(self, max_in_flight=HOST_MAX_IN_FLIGHT, requests_per_second=HOST_REQUESTS_PER_SECOND, max_queue=HOST_MAX_QUEUE):
+    self.max_in_flight = max_in_flight
+    self.requests_per_second = requests_per_second
+    self.max_queue = max_queue
+    self._semaphores = {}
+    self._next_start = {}
+    self._waiting = {}
+    self._in_flight = {}
+
+  @asynccontextmanager
+  async def slot(self, host):
+    """Waits until a request to the given host may start"""
+    if self._waiting.get(host, 0) >= self.max_queue:
+      raise HostLimitExceeded(f'{self._waiting[host]} requests to {host} are already waiting')
+    semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.max_in_flight))
+    self._waiting[host] = self._waiting.get(host, 0) + 1
+    try:
+      await semaphore.acquire()
+      try:
+        # Reserve the next start time of this host so requests are spread evenly
+        now = time.monotonic()
+        start = max(now, self._next_start.get(host, now))
+        self._next_start[host] = start + 1 / self.requests_per_second
+        if start > now:
+          await asyncio.sleep(start - now)
+      except BaseException:
+        semaphore.release()
+        raise
+    finally:
+      self._waiting[host] -= 1
+    self._in_flight[host] = self._in_flight.get(host, 0) + 1
+    try:
+      yield
+    finally:
+      self._in_flight[host] -= 1
+      semaphore.release()
+
+  def queue_depths(self):
+    """Returns {host: (waiting, in_flight)} for all hosts with pending requests"""
+    return {host: (self._waiting.get(host, 0), self._in_flight.get(host, 0))
+            for host in self._semaphores
+            if self._waiting.get(host, 0) or self._in_flight.get(host, 0)}
+
+host_scheduler = HostScheduler()
+# Hosts that keep failing are paused, see breaker.py
+host_breaker = CircuitBreaker()
+
+def is_host_failure(error) -> bool:
+    """Network errors, server errors and rate limiting count against the host, other HTTP errors concern only the Link"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return not isinstance(error, BodyTooLarge)
+
+def fake_headers():
+    """Generates the headers of a random browser"""
+    return FakeHttpHeader(domain_name = 'de').as_header_dict()
+
+class HeaderPool:
+  """Browser headers generated once and handed out round-robin to the hosts.
+  A host keeps its headers until the pool is regenerated, so the requests over a kept-alive connection do not switch the user agent."""
+  def __init__(self, size=HEADER_POOL_SIZE, refresh=HEADER_POOL_REFRESH):
+    self.size = size
+    self.refresh = refresh
+    self._headers = []
+    self._by_host = {}
+    self._next = 0
+    self._generated = None
+
+  def _generate(self):
+    self._headers = [fake_headers() for _ in range(self.size)]
+    self._by_host.clear()
+    self._generated = time.monotonic()
+
+  def headers(self, host):
+    """Returns a copy of the headers of the given host, so a request can add its own"""
+    if self._generated is None or time.monotonic() - self._generated > self.refresh:
+      self._generate()
+    headers = self._by_host.get(host)
+    if headers is None:
+      headers = self._by_host[host] = self._headers[self._next % self.size]
+      self._next += 1
+    return dict(headers)
+
+header_pool = HeaderPool()
+
+def host_statistics(depths=None):
+    """Returns a short summary of the waiting and running requests per host (default: of this process)"""
+    depths = host_scheduler.queue_depths() if depths is None else depths
+    if not depths:
+        return "no pending requests"
+    return ", ".join(f'{host}: {waiting} waiting, {in_flight} running' for host, (waiting, in_flight) in sorted(depths.items()))
+
+def connection_statistics(stats=None):
+    """Returns a short summary of the connections of the shared client and how often they were reused (default: of this process)"""
+    stats = CONNECTION_STATS if stats is None else stats
+    responses = stats["responses"]
+    reused = max(responses - stats["connections"], 0) / responses * 100 if responses else 0
+    return (f'{responses} responses over {stats["connections"]} connections ({reused:.1f}% reused), '
+            f'{stats["tls_handshakes"]} TLS handshakes, '
+            f'HTTP/2 {stats["HTTP/2"]}, HTTP/1.1 {stats["HTTP/1.1"]}'
+            + ('' if http2_enabled() else ' (HTTP/2 off, install "h2")'))
+
+def http2_enabled() -> bool:
+    """HTTP/2 needs the optional "h2" package"""
+    return HTTP2 and h2 is not None
+
+async def _trace(URL, event, info):
+    """Counts the connections and TLS handshakes of the shared client, passed as "trace" extension to httpcore"""
+    if event == "connection.connect_tcp.complete":
+        CONNECTION_STATS["connections"] += 1
+        metrics.connection(URL)
+    elif event == "connection.start_tls.complete":
+        CONNECTION_STATS["tls_handshakes"] += 1
+        metrics.handshake(URL)
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the shared HTTP client. Connections are pooled and kept alive between checks."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY),
+            http2=http2_enabled(),
+            follow_redirects=True)
+    return _client
+
+async def close_client():
+    """Closes the shared HTTP client and all of its pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+class BodyTooLarge(Exception):
+  """Raised if a response body exceeds the maximum size of a download"""
+
+
+class Page:
+  """Status, headers and body of a downloaded page. complete is False if reading stopped early, after the markers of until."""
+  def __init__(self, status_code, headers, content, complete=True, until=None):
+    self.status_code = status_code
+    self.headers = headers
+    self.content = content
+    self.complete = complete
+    self.until = until
+
+
+class StopReading:
+  """Tells a streaming download to stop once all markers (bytes) have been read, 
+  in the given order if ordered is set."""
+  def __init__(self, markers, ordered=False):
+    self.markers = tuple(markers)
+    self.ordered = ordered
+
+  def __eq__(self, other):
+    return isinstance(other, StopReading) and (self.markers, self.ordered) == (other.markers, other.ordered)
+
+  def __hash__(self):
+    return hash((self.markers, self.ordered))
+
+  def satisfied(self, body, start, found) -> bool:
+    """Searches the markers in the data read since start and records their positions in found"""
+    for i, marker in enumerate(self.markers):
+      if found[i] is not None:
+        continue
+      begin = max(start - len(marker) + 1, 0)
+      if self.ordered and i > 0:
+        begin = max(begin, found[i - 1] + len(self.markers[i - 1]))
+      position = body.find(marker, begin)
+      if position != -1:
+        found[i] = position
+      elif self.ordered:
+        break
+    return all(position is not None for position in found)
+
+# Reading a Zalando page can stop once the end of the product JSON has been read
+ZALANDO_STOP = StopReading((ZALANDO_START.encode(), ZALANDO_END.encode()), ordered=True)
+
+class SharedDownload:
+  """A running download of a Link and the markers all of its waiters may stop at (None reads the whole body)"""
+  def __init__(self, URL, conditional, until):
+    self.URL = URL
+    self.conditional = conditional
+    self.until = until
+    self.task = asyncio.ensure_future(_fetch(self))
+
+async def _read_body(response, download, max_bytes):
+    """Reads the body in chunks until it is complete or the markers of the download were read.
+    Returns the content and the markers it stopped after (None if it is complete)."""
+    body = bytearray()
+    until = download.until
+    found = [None] * len(until.markers) if until is not None else None
+    drain_to = None
+    async for chunk in response.aiter_bytes():
+        start = len(body)
+        body += chunk
+        if max_bytes and len(body) > max_bytes:
+            raise BodyTooLarge(f'{response.url} is larger than {max_bytes} bytes')
+        if download.until is not until:
+            # A waiter with other markers joined, so the whole body is read
+            until = found = drain_to = None
+        if drain_to is not None:
+            if len(body) >= drain_to:
+                return bytes(body), until
+        elif until is not None and until.satisfied(body, start, found):
+            if response.http_version == "HTTP/2":
+                return bytes(body), until
+            drain_to = len(body) + EARLY_STOP_DRAIN
+    return bytes(body), None
+
+async def _fetch(download):
+    """Performs the actual request of a SharedDownload and remembers the page for later callers.
+    Conditional requests send the stored validators of the Link and may be answered with 304."""
+    URL, conditional = download.URL, download.conditional
+    try:
+        host = httpx.URL(URL).host
+        fake_header_dict = header_pool.headers(host)
+        validators = _validators.get(URL)
+        if conditional and validators is not None:
+            if validators["etag"]:
+                fake_header_dict["If-None-Match"] = validators["etag"]
+            if validators["last_modified"]:
+                fake_header_dict["If-Modified-Since"] = validators["last_modified"]
+            CONDITIONAL_STATS["requests"] += 1
+        host_breaker.acquire(host)
+        async with host_scheduler.slot(host):
+            # Time spent waiting for the host slot is not part of the transfer
+            start = time.perf_counter()
+            try:
+                async with get_client().stream("GET", URL, headers=fake_header_dict, extensions={"trace": functools.partial(_trace, URL)}) as response:
+                    CONNECTION_STATS["responses"] += 1
+                    CONNECTION_STATS[response.http_version] = CONNECTION_STATS.get(response.http_version, 0) + 1
+                    if conditional and validators is not None and response.status_code == 304:
+                        metrics.transfer(URL, time.perf_counter() - start, 304, 0)
+                        CONDITIONAL_STATS["not_modified"] += 1
+                        CONDITIONAL_STATS["bytes_saved"] += validators["size"]
+                        host_breaker.success(host)
+                        result = (Page(304, response.headers, b""), validators["version"])
+                        cached = _recent.get(URL)
+                        if cached is not None and cached[1][0].status_code != 304 and cached[1][1] == result[1]:
+                            # The 304 confirms the recent full page, which is of use to more callers than the 304
+                            _remember(URL, cached[1])
+                        else:
+                            _remember(URL, result)
+                        return result
+                    # If the response was successful, no Exception will be raised
+                    response.raise_for_status()
+                    content, until = await _read_body(response, download, MAX_BODY_BYTES)
+            except Exception as err:
+                if isinstance(err, httpx.HTTPStatusError):
+                    metrics.transfer(URL, time.perf_counter() - start, err.response.status_code, 0)
+                metrics.transfer_error(URL, err)
+                if not is_host_failure(err):
+                    host_breaker.success(host)
+                else:
+                    paused = host_breaker.failure(host)
+                    if paused:
+                        print(f'{host} keeps failing ({type(err).__name__}), pausing it for {paused} seconds')
+                raise
+        if host_breaker.success(host):
+            print(f'{host} is reachable again')
+        metrics.transfer(URL, time.perf_counter() - start, response.status_code, len(content))
+        page = Page(response.status_code, response.headers, content, until is None, until)
+        version = _store_validators(URL, page)
+        result = (page, version)
+        _remember(URL, result)
+        return result
+    finally:
+        if _inflight.get(URL) is download:
+            del _inflight[URL]
+
+def _store_validators(URL, page):
+    """Remembers ETag and Last-Modified of a full response. Returns the new version of the Link."""
+    etag = page.headers.get("ETag")
+    last_modified = page.headers.get("Last-Modified")
+    previous = _validators.get(URL)
+    if previous is not None and etag and previous["etag"] == etag and previous["last_modified"] == last_modified:
+        # Same validators, same content: callers that evaluated this version stay up to date
+        return previous["version"]
+    # The counter outlives the validators, so a version is never handed out twice for a Link
+    version = _versions[URL] = _versions.get(URL, 0) + 1
+    if etag or last_modified:
+        _validators[URL] = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": len(page.content) if page.complete else int(page.headers.get("Content-Length") or len(page.content)),
+            "version": version}
+    else:
+        _validators.pop(URL, None)
+    return version
+
+def forget_job(conditional_key):
+    """Drops the version a deleted job has evaluated and its metrics"""
+    _seen.pop(conditional_key, None)
+    metrics.forget(conditional_key)
+
+def _remember(URL, result):
+    """Keeps a response for later callers of the Link"""
+    global _recent_bytes
+    _drop_recent(URL)
+    _recent[URL] = (time.monotonic(), result)
+    _recent_bytes += len(result[0].content)
+    while _recent_bytes > RECENT_BYTES:
+        _drop_recent(next(iter(_recent)))
+
+def _drop_recent(URL):
+    global _recent_bytes
+    entry = _recent.pop(URL, None)
+    if entry is not None:
+        _recent_bytes -= len(entry[1][0].content)
+
+def _sweep_recent(now):
+    """Drops the responses no caller may reuse anymore. The dict is ordered by the time of the responses, the oldest come first."""
+    while _recent:
+        URL = next(iter(_recent))
+        if now - _recent[URL][0] < _recent_age:
+            return
+        _drop_recent(URL)
+
+def _usable(page, conditional, until) -> bool:
+    """A 304 only answers conditional callers and a body cut off early only callers stopping at the same markers"""
+    if page.status_code == 304:
+        return conditional
+    return page.complete or page.until == until
+
+async def fetch_shared(URL, conditional=False, until=None, max_age=FRESHNESS_WINDOW):
+    """Fetches the given Link, unless a response younger than max_age seconds can be reused.
+    Concurrent and recent callers of the same Link receive the same (page, version) tuple.
+    The body is only cut off early if all waiters stop at the same markers."""
+    global _recent_age
+    _recent_age = max(_recent_age, max_age)
+    now = time.monotonic()
+    _sweep_recent(now)
+    cached = _recent.get(URL)
+    if cached is not None and now - cached[0] < max_age and _usable(cached[1][0], conditional, until):
+        return cached[1]
+    download = _inflight.get(URL)
+    if download is not None:
+        if download.until != until:
+            download.until = None
+        # A cancelled caller must not cancel the download the other callers are waiting for
+        result = await asyncio.shield(download.task)
+        if _usable(result[0], conditional, until):
+            return result
+        # Joined too late: the answer was a 304 or the body was already cut off at other markers
+    download = _inflight[URL] = SharedDownload(URL, conditional, until)
+    return await asyncio.shield(download.task)
+
+def conditional_statistics(stats=None):
+    """Returns a short summary of the conditional GET cache (default: of this process)"""
+    stats = CONDITIONAL_STATS if stats is None else stats
+    requests_sent = stats["requests"]
+    hits = stats["not_modified"]
+    rate = hits / requests_sent * 100 if requests_sent else 0
+    return (f'{hits}/{requests_sent} conditional requests not modified ({rate:.1f}%), '
+            f'{stats["bytes_saved"] / 1024 / 1024:.1f} MB not downloaded')
+
+def diagnostics():
+    """Returns the counters of the checks run in this process, so the bot can show those of its worker processes"""
+    return {
+        "conditional": dict(CONDITIONAL_STATS),
+        "connections": dict(CONNECTION_STATS),
+        "queues": host_scheduler.queue_depths(),
+        "paused_hosts": host_breaker.open_circuits(),
+        "metrics": metrics}
+
+def merge_diagnostics(snapshots):
+    """Adds up the diagnostics of several processes"""
+    merged = {"conditional": {}, "connections": {}, "queues": {}, "paused_hosts": [], "metrics": Metrics()}
+    for snapshot in snapshots:
+        for kind in ("conditional", "connections"):
+            for key, value in snapshot[kind].items():
+                merged[kind][key] = merged[kind].get(key, 0) + value
+        # Every host is checked by one worker only
+        merged["queues"].update(snapshot["queues"])
+        merged["paused_hosts"] += snapshot["paused_hosts"]
+        merged["metrics"].merge(snapshot["metrics"])
+    merged["paused_hosts"].sort(key=lambda entry: entry[1], reverse=True)
+    return merged
+
+async def async_download(URL, asRawResponse=False, conditional_key=None, until=None, max_age=FRESHNESS_WINDOW, raise_errors=False):
+    """Downloads the content of the given Link without blocking the event loop and returns plain text (or the Page).
+    Callers passing a conditional_key (e.g. a JobID) get NOT_MODIFIED if the Link did not change since their last download,
+    their downloads are recorded in the job metrics under that key and a failed download raises its error instead of returning None,
+    as it does with raise_errors.
+    With until (StopReading) the body is only read until its markers were found, a response of the Link younger than max_age seconds is reused."""
+    conditional = (conditional_key is not None and URL in _validators
+                   and _seen.get(conditional_key) == (URL, _validators[URL]["version"]))
+    start = time.perf_counter()
+    try:
+        page, version = await fetch_shared(URL, conditional, until, max_age)
+
+    except CircuitOpen:
+        # The check is skipped, not failed
+        raise
+    except httpx.HTTPStatusError as http_err:
+        if not raise_errors:
+            print(f'HTTP Error: {http_err}')
+        if conditional_key is not None:
+            metrics.fetch_error(conditional_key, http_err)
+        if conditional_key is not None or raise_errors:
+            raise
+    except Exception as err:
+        if not raise_errors:
+            print(f'Connection Error: {err}')
+        if conditional_key is not None:
+            metrics.fetch_error(conditional_key, err)
+        if conditional_key is not None or raise_errors:
+            raise
+    else:
+        if conditional_key is not None:
+            metrics.fetch(conditional_key, time.perf_counter() - start, page.status_code, len(page.content))
+        if page.status_code == 304:
+            return NOT_MODIFIED
+        if conditional_key is not None:
+            _seen[conditional_key] = (URL, version)
+        if asRawResponse:
+            return page
+        else:
+            # A body cut off early may end within a character
+            txt = page.content.decode("utf-8", "strict" if page.complete else "ignore")
+            return txt
+
+def extract_zalando_json(txt):
+    """Locates the relevant JSON Data in a downloaded Zalando page. Returns JSON Data ready to parse."""
     try:
         str_index = txt.index('{"data":{"customer":{"sizeProfile')
         txt = txt[str_index+8:]
@@ -41,7 +557,18 @@ def download_zalando_json(URL):
         return txt
     except:
         print('Error: Zalando JSON Data not found.')
-   
+
+def download_zalando_json(URL):
+    """Downloads the given Zalando Link and locates the relevant JSON Data. Returns JSON Data ready to parse."""
+    return extract_zalando_json(download(URL))
+
+async def async_download_zalando_json(URL, conditional_key=None):
+    """Downloads the given Zalando Link without blocking and locates the relevant JSON Data."""
+    txt = await async_download(URL, conditional_key=conditional_key)
+    if txt is NOT_MODIFIED:
+        return NOT_MODIFIED
+    return extract_zalando_json(txt)
+
 
 def parse_available_sizes(raw_data):
     """Parses Zalando JSON and returns all Sizes that are currently available"""
@@ -81,7 +608,56 @@ def parse_name(raw_data):
         brand = items["product"]["brand"]["name"]
         name = items["product"]["name"]
     return brand + ' ' + name
+
+class ZalandoSnapshot:
+  """Product data of a Zalando page: brand, name, all sizes and the sizes in stock"""
+  def __init__(self, Brand, Name, All_Sizes, Available_Sizes):
+    self.Brand = Brand
+    self.Name = Name
+    self.All_Sizes = All_Sizes
+    self.Available_Sizes = Available_Sizes
+
+  def full_name(self):
+    return self.Brand + ' ' + self.Name
+
+  def soldout_sizes(self):
+    return find_soldout_items(self.All_Sizes, self.Available_Sizes)
+
+def parse_zalando_snapshot(txt) -> ZalandoSnapshot:
+    """Locates and decodes the product JSON of a Zalando page (text or bytes) in a single pass. Raises ValueError if it is missing."""
+    if txt is None:
+        raise ValueError('Zalando page could not be downloaded.')
+    if isinstance(txt, bytes):
+        start = txt.find(ZALANDO_STOP.markers[0])
+        end = txt.find(ZALANDO_STOP.markers[1], start) if start != -1 else -1
+    else:
+        start = txt.find(ZALANDO_START)
+        end = txt.find(ZALANDO_END, start) if start != -1 else -1
+    if end == -1:
+        raise ValueError('Zalando JSON Data not found.')
+    # Skip '{"data":' so the object holding "customer" and "product" is decoded
+    product = json.loads(txt[start+8:end+1])["product"]
+    return ZalandoSnapshot(
+        product["brand"]["name"],
+        product["name"],
+        [i["size"] for i in product["simples"]],
+        [i["size"] for i in product["simplesWithStock"]])
+
+async def async_download_zalando_snapshot(URL, conditional_key=None, max_age=FRESHNESS_WINDOW, raise_errors=False):
+    """Downloads the given Zalando Link without blocking and returns its ZalandoSnapshot (or NOT_MODIFIED).
+    Only the page up to the end of the product JSON is read, and only the JSON is decoded."""
+    page = await async_download(URL, True, conditional_key=conditional_key, until=ZALANDO_STOP, max_age=max_age, raise_errors=raise_errors)
+    if page is NOT_MODIFIED:
+        return NOT_MODIFIED
+    if conditional_key is None:
+        return parse_zalando_snapshot(page.content if page is not None else None)
+    with metrics.parsing(conditional_key, URL):
+        return parse_zalando_snapshot(page.content if page is not None else None)
     
+def migrate_zalando_state(stored_update):
+    """Converts the list of available sizes of older versions to a tuple"""
+    return tuple(stored_update or ())
+
 def check_if_soldout(available_sizes, search_size) -> bool:
     """Checks if the desired size is in the available-sizes-list"""
     if search_size in available_sizes:
@@ -89,16 +665,269 @@ def check_if_soldout(available_sizes, search_size) -> bool:
     else:
         return True
 
+def content_digest(content) -> str:
+    """Returns a compact digest of the given page content (bytes or text)"""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+class PageState(NamedTuple):
+  """Stored state of a Simple Update Check: digest of the page, plus a compressed snapshot if diffs are wanted"""
+  digest: Optional[str]
+  snapshot: Optional[bytes] = None
+
+def suc_state(content):
+    """Builds the stored state of a Simple Update Check from the downloaded page content"""
+    return PageState(content_digest(content), zlib.compress(content) if SUC_KEEP_SNAPSHOT else None)
+
+def migrate_suc_state(stored_update):
+    """Converts a stored page of older versions (the full decoded text) or the former dict to a PageState"""
+    if isinstance(stored_update, PageState):
+        return stored_update
+    if isinstance(stored_update, dict):
+        return PageState(stored_update.get("digest"), stored_update.get("snapshot"))
+    if not stored_update:
+        return PageState(None)
+    return suc_state(stored_update.encode("utf-8"))
+
+def page_diff(old_state, new_state) -> str:
+    """Returns the first changed lines between the snapshots of two SUC states, if both have one"""
+    if not old_state.snapshot or not new_state.snapshot:
+        return ""
+    old_lines = zlib.decompress(old_state.snapshot).decode("utf-8", "replace").splitlines()
+    new_lines = zlib.decompress(new_state.snapshot).decode("utf-8", "replace").splitlines()
+    changes = [line[:200] for line in difflib.unified_diff(old_lines, new_lines, lineterm="", n=0)
+               if line[:1] in "+-" and line[:3] not in ("+++", "---")]
+    return "\n".join(changes[:SUC_DIFF_LINES])
+
+def html_parser(parser=None):
+    """Returns the configured HTML parser, falling back to html.parser if lxml is not installed"""
+    parser = parser or SIL_PARSER
+    if parser == "lxml" and lxml is None:
+        return "html.parser"
+    return parser
+
+def _has_class(target, value):
+    """Matches the class attribute of an element while parsing, where it is still the raw string of all its classes"""
+    if value is None:
+        return False
+    return target in (value.split() if isinstance(value, str) else value)
+
+def find_list_element(content, target, parser=None, targeted=None):
+    """Finds the element with the given ID or, if there is none, the first element with the given class. 
+    In targeted mode only the subtrees of matching elements are built."""
+    parser = html_parser(parser)
+    targeted = SIL_TARGETED if targeted is None else targeted
+    if targeted:
+        # Neither ID nor class can match if the name does not appear anywhere in the page
+        raw_target = target.encode("utf-8") if isinstance(content, bytes) else target
+        if raw_target not in content:
+            return None
+        soup = BeautifulSoup(content, parser, parse_only=SoupStrainer(id=target))
+        target_element = soup.find(id=target)
+        if not target_element:
+            soup = BeautifulSoup(content, parser, parse_only=SoupStrainer(class_=functools.partial(_has_class, target)))
+            target_element = soup.find(class_=target)
+        return target_element
+    soup = BeautifulSoup(content, parser)
+    # Try to find an element by ID first
+    target_element = soup.find(id=target)
+    if not target_element:
+        # If no element with the ID was found, try to find the first occurrence of the class
+        target_element = soup.find(class_=target)
+    return target_element
+
+def normalize_element(text, rules=None):
+    """Applies the normalization rules (default: SIL_NORMALIZATION_RULES) to the HTML of a list element"""
+    rules = tuple(SIL_NORMALIZATION_RULES if rules is None else rules)
+    compiled = _compiled_rules.get(rules)
+    if compiled is None:
+        compiled = _compiled_rules[rules] = [(re.compile(pattern), replacement) for pattern, replacement in rules]
+    for pattern, replacement in compiled:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+def element_fingerprint(text, rules=None) -> int:
+    """Returns a stable 64 bit fingerprint of the normalized HTML of a list element"""
+    digest = hashlib.blake2b(normalize_element(text, rules).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+def element_fingerprints(elements, rules=None):
+    """Fingerprints the HTML of all given list elements"""
+    return [element_fingerprint(text, rules) for text in elements]
+
+def migrate_sil_state(stored_update, rules=None):
+    """Converts the element HTML stored by older versions to a set of fingerprints"""
+    if isinstance(stored_update, frozenset):
+        return stored_update
+    return frozenset(element if isinstance(element, int) else element_fingerprint(element, rules)
+                     for element in stored_update or [])
+
+def parse_search_terms(text) -> List:
+    """Splits the message of the user into search terms, one per line"""
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def is_pattern(term) -> bool:
+    """Terms wrapped in slashes are regular expressions"""
+    return len(term) > 2 and term.startswith("/") and term.endswith("/")
+
+class TermMatcher:
+  """Finds which of several literal terms or /regex/ patterns occur in a downloaded page.
+  Literal terms are searched in the raw bytes, only /regex/ patterns need the decoded text and are compiled on their own,
+  so their group references and inline flags keep working."""
+  def __init__(self, terms):
+    if not terms:
+      raise ValueError("no search term given")
+    self.terms = tuple(terms)
+    self.literals = [(i, term.encode("utf-8")) for i, term in enumerate(self.terms) if not is_pattern(term)]
+    self.patterns = [(i, re.compile(term[1:-1])) for i, term in enumerate(self.terms) if is_pattern(term)]
+    self.complete = (1 << len(self.terms)) - 1
+    # Literal terms allow to stop downloading once all of them have been read
+    self.stop = None if self.patterns else StopReading(literal for _, literal in self.literals)
+
+  def present(self, content) -> int:
+    """Returns a bit mask with bit i set if term i occurs in the content (bytes)"""
+    found = 0
+    for i, literal in self.literals:
+      if literal in content:
+        found |= 1 << i
+    if self.patterns:
+      text = content.decode("utf-8")
+      for i, pattern in self.patterns:
+        if pattern.search(text):
+          found |= 1 << i
+    return found
+
+@functools.lru_cache(maxsize=1024)
+def _term_matcher(terms):
+    return TermMatcher(terms)
+
+def term_matcher(terms) -> TermMatcher:
+    """Returns the (cached) matcher of the given search terms"""
+    return _term_matcher(tuple(terms))
+
+def term_changes(terms, old_present, new_present) -> str:
+    """Describes which terms appeared or disappeared between two bit masks"""
+    message = ""
+    for i, term in enumerate(terms):
+        is_present = bool(new_present & (1 << i))
+        if old_present is None or bool(old_present & (1 << i)) != is_present:
+            message = message + '\n"' + term + ('" found' if is_present else '" not found anymore')
+    return message
+
+def migrate_sfs_state(search_for, stored_update):
+    """Converts the single search term and bool state of older versions to a term list and bit mask"""
+    if isinstance(search_for, str):
+        search_for = [search_for]
+    if stored_update is True or stored_update is False:
+        stored_update = int(stored_update)
+    elif not isinstance(stored_update, int):
+        # Older versions stored the type bool itself until the first check
+        stored_update = None
+    return search_for, stored_update
+
+class CheckResult:
+  """Outcome of one check of an assignment: the new Stored_Update and the alarm message, if any.
+  This is all a worker process sends back to the bot."""
+  def __init__(self, Stored_Update, changed=False, message=None, not_modified=False, missing=False):
+    self.Stored_Update = Stored_Update
+    self.changed = changed
+    self.message = message
+    self.not_modified = not_modified
+    self.missing = missing
+
+async def zalando_check(JobID, Name, Link, Search_For, Stored_Update, max_age=FRESHNESS_WINDOW) -> CheckResult:
+    """Downloads a Zalando Link and compares the availability of the wanted sizes with the stored one"""
+    snapshot = await async_download_zalando_snapshot(Link, JobID, max_age)
+    if snapshot is NOT_MODIFIED:
+        return CheckResult(Stored_Update, not_modified=True)
+    available_sizes = tuple(snapshot.Available_Sizes)
+    if available_sizes == Stored_Update:
+        return CheckResult(Stored_Update)
+    was_soldout = []
+    is_soldout = []
+    message = ""
+    for size in Search_For:
+        if check_if_soldout(Stored_Update, size):
+            was_soldout.append(size)
+        if check_if_soldout(available_sizes, size):
+            message = message + "\nSize " + size + " not available"
+            is_soldout.append(size)
+        else:
+            message = message + "\nSize " + size + " is available!"
+    # Changes of other sizes are stored, but no alarm
+    if was_soldout != is_soldout:
+        return CheckResult(available_sizes, changed=True, message="Update for " + Name + message + "\n" + Link)
+    return CheckResult(available_sizes)
+
+async def suc_check(JobID, Name, Link, Search_For, Stored_Update, max_age=FRESHNESS_WINDOW) -> CheckResult:
+    """Downloads a Link and compares the digest of the page with the stored one"""
+    response = await async_download(Link, True, conditional_key=JobID, max_age=max_age)
+    if response is NOT_MODIFIED:
+        return CheckResult(Stored_Update, not_modified=True)
+    # Only the digest of the page is compared and stored
+    with metrics.parsing(JobID, Link):
+        current_state = suc_state(response.content)
+    if current_state.digest == Stored_Update.digest:
+        return CheckResult(Stored_Update)
+    diff = page_diff(Stored_Update, current_state)
+    return CheckResult(current_state, changed=True, message="Update for " + Link + ("\n\n" + diff if diff else ""))
+
+async def sfs_check(JobID, Name, Link, Search_For, Stored_Update, max_age=FRESHNESS_WINDOW) -> CheckResult:
+    """Downloads a Link and compares which of the search terms are present with the stored bit mask"""
+    matcher = term_matcher(Search_For)
+    page = await async_download(Link, True, conditional_key=JobID, until=matcher.stop, max_age=max_age)
+    if page is NOT_MODIFIED:
+        return CheckResult(Stored_Update, not_modified=True)
+    # Stored_Update holds one bit per search term, set if the term is present
+    if page is None:
+        # A failed download says nothing about the terms
+        raise ValueError('Page could not be downloaded.')
+    if not page.complete:
+        # The download stopped early because all terms have been read
+        terms_present = matcher.complete
+    else:
+        with metrics.parsing(JobID, Link):
+            terms_present = matcher.present(page.content)
+    if terms_present == Stored_Update:
+        return CheckResult(Stored_Update)
+    return CheckResult(terms_present, changed=True, message="Update for " + Link + term_changes(Search_For, Stored_Update, terms_present))
+
+async def sil_check(JobID, Name, Link, Search_For, Stored_Update, max_age=FRESHNESS_WINDOW) -> CheckResult:
+    """Downloads a Link and compares the fingerprints of the elements of the list identified by ID or class with the stored ones"""
+    response = await async_download(Link, True, conditional_key=JobID, max_age=max_age)
+    if response is NOT_MODIFIED:
+        return CheckResult(Stored_Update, not_modified=True)
+    if response.status_code != 200:
+        print("Failed to fetch the webpage " + Link + ". Status: " + str(response.status_code))
+    # Parse the element with the given ID or class using the configured parser backend
+    with metrics.parsing(JobID, Link):
+        target_element = find_list_element(response.content, Search_For)
+        if target_element:
+            # Fingerprint the normalized HTML of each direct child (e.g. without timestamps 'ts=[numbers]')
+            child_elements = target_element.find_all(recursive=False)
+            current_fingerprints = frozenset(element_fingerprints(str(element) for element in child_elements))
+    if not target_element:
+        return CheckResult(Stored_Update, missing=True)
+    new_elements = current_fingerprints - Stored_Update
+    if not new_elements:
+        return CheckResult(current_fingerprints)
+    return CheckResult(current_fingerprints, changed=True,
+                       message=f"Update for {Link}: New element(s) added to the list with ID or class {Search_For}")
+
+# Checks by name, so a worker process can be told which one to run.
+# They take the fields of an assignment and how old (max_age) a response of the Link shared with other jobs may be.
+CHECKS = {check.__name__: check for check in (zalando_check, suc_check, sfs_check, sil_check)}
+
 def test(URL, search_sizes: List):
     """Processes a Zalando Link and searches for the given Size(s)."""
     try:
-        data = download_zalando_json(URL)
-        all_sizes = parse_all_sizes(data)
-        available_sizes = parse_available_sizes(data)
-        print('Name: ' + parse_name(data))
-        print('Sizes: ' + str(all_sizes))
+        snapshot = parse_zalando_snapshot(download(URL))
+        available_sizes = snapshot.Available_Sizes
+        print('Name: ' + snapshot.full_name())
+        print('Sizes: ' + str(snapshot.All_Sizes))
         print('Available Sizes: ' + str(available_sizes))
-        print('Sold out: ' + str(find_soldout_items(all_sizes,available_sizes)))
+        print('Sold out: ' + str(snapshot.soldout_sizes()))
         for size in search_sizes: 
             if check_if_soldout(available_sizes, size):
                 print("Size " + size + " not available.")
@@ -108,4 +937,82 @@ def test(URL, search_sizes: List):
     except:
         print ("Check not Successful. Try again later.")
 
+async def check_zalando(URL, search_sizes: List):
+    """Checks one Zalando Link for the given Size(s) and returns the result as dict"""
+    start = time.perf_counter()
+    result = {"url": URL, "sizes": list(search_sizes)}
+    try:
+        # The error of a failed download is reported instead of a missing page
+        snapshot = await async_download_zalando_snapshot(URL, raise_errors=True)
+        result.update({
+            "ok": True,
+            "name": snapshot.full_name(),
+            "all_sizes": snapshot.All_Sizes,
+            "available_sizes": snapshot.Available_Sizes,
+            "available": [size for size in search_sizes if not check_if_soldout(snapshot.Available_Sizes, size)]})
+    except Exception as err:
+        result.update({"ok": False, "error": str(err), "error_type": type(err).__name__})
+    result["latency"] = round(time.perf_counter() - start, 4)
+    return result
+
+async def check_zalando_batch(pairs, workers=BATCH_WORKERS):
+    """Checks many (URL, search_sizes) pairs concurrently with at most the given number of workers. 
+    Returns one result dict per pair, in the order of the pairs."""
+    semaphore = asyncio.Semaphore(workers)
+
+    async def worker(URL, search_sizes):
+        async with semaphore:
+            return await check_zalando(URL, search_sizes)
+
+    return await asyncio.gather(*(worker(URL, search_sizes) for URL, search_sizes in pairs))
+
+def read_batch(file):
+    """Reads (URL, search_sizes) pairs from lines like "https://www.zalando.de/... M XS" """
+    pairs = []
+    for line in file:
+        fields = line.split()
+        if fields and not fields[0].startswith("#"):
+            pairs.append((fields[0], fields[1:]))
+    return pairs
+
+def percentile(values, share):
+    """Returns the value below which the given share of the sorted values falls"""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+async def run_batch(pairs, output, workers):
+    """Checks all pairs, writes one JSON line per result and returns a throughput summary"""
+    start = time.perf_counter()
+    try:
+        results = await check_zalando_batch(pairs, workers)
+    finally:
+        await close_client()
+    elapsed = time.perf_counter() - start
+    for result in results:
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+    latencies = sorted(result["latency"] for result in results)
+    successful = sum(1 for result in results if result["ok"])
+    return (f'{len(results)} Links checked ({successful} successful) in {elapsed:.2f} s, '
+            f'{len(results) / elapsed if elapsed else 0:.1f} Links/s, '
+            f'latency p50 {percentile(latencies, 0.5):.3f} s, p95 {percentile(latencies, 0.95):.3f} s, max {percentile(latencies, 1):.3f} s')
+
+def batch_main(argv=None):
+    """Command line interface of the bulk Zalando checker"""
+    parser = argparse.ArgumentParser(description="Checks many Zalando Links for sizes and writes the results as JSON lines.")
+    parser.add_argument("input", help='file with one Link per line, followed by the sizes to search for ("-" for stdin)')
+    parser.add_argument("output", help="file to write the JSON lines to")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="number of concurrent checks")
+    parser.add_argument("--rps", type=float, default=HOST_REQUESTS_PER_SECOND, help="requests per second per host")
+    args = parser.parse_args(argv)
+    host_scheduler.requests_per_second = args.rps
+    with (sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")) as file:
+        pairs = read_batch(file)
+    with open(args.output, "w", encoding="utf-8") as output:
+        summary = asyncio.run(run_batch(pairs, output, args.workers))
+    print(summary, file=sys.stderr)
+
 #test("https://www.zalando.de/triumph-shapewear-white-tr581c00x-a11.html",['M','XS'])
+
+if __name__ == '__main__':
+    batch_main()
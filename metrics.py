@@ -0,0 +1,220 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# Upper bounds of the histogram buckets in seconds, the last bucket takes everything above
+SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def host_of(URL):
+    return urlsplit(URL).hostname or URL
+
+
+class Histogram:
+  """Counts observations in fixed buckets, so it needs the same little memory for one or a million checks"""
+  __slots__ = ("counts", "count", "sum", "max")
+
+  def __init__(self):
+    self.counts = [0] * (len(SECONDS_BUCKETS) + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def observe(self, value):
+    index = 0
+    while index < len(SECONDS_BUCKETS) and value > SECONDS_BUCKETS[index]:
+      index += 1
+    self.counts[index] += 1
+    self.count += 1
+    self.sum += value
+    self.max = max(self.max, value)
+
+  def merge(self, other):
+    for index, count in enumerate(other.counts):
+      self.counts[index] += count
+    self.count += other.count
+    self.sum += other.sum
+    self.max = max(self.max, other.max)
+
+  def quantile(self, share):
+    """Estimates the given quantile as the upper bound of the bucket it falls into"""
+    if not self.count:
+      return 0.0
+    rank = share * self.count
+    seen = 0
+    for index, count in enumerate(self.counts):
+      seen += count
+      if seen >= rank:
+        return min(SECONDS_BUCKETS[index], self.max) if index < len(SECONDS_BUCKETS) else self.max
+    return self.max
+
+
+class Series:
+  """Metrics of one job or one host. Connections and TLS handshakes are only counted for hosts."""
+  __slots__ = ("fetch", "parse", "bytes", "statuses", "errors", "connections", "handshakes")
+
+  def __init__(self):
+    self.fetch = Histogram()
+    self.parse = Histogram()
+    self.bytes = 0
+    self.statuses = {}
+    self.errors = {}
+    self.connections = 0
+    self.handshakes = 0
+
+  def response(self, seconds, status, size):
+    self.fetch.observe(seconds)
+    self.bytes += size
+    self.statuses[status] = self.statuses.get(status, 0) + 1
+
+  def error(self, kind):
+    self.errors[kind] = self.errors.get(kind, 0) + 1
+
+  def merge(self, other):
+    self.fetch.merge(other.fetch)
+    self.parse.merge(other.parse)
+    self.bytes += other.bytes
+    for status, count in other.statuses.items():
+      self.statuses[status] = self.statuses.get(status, 0) + count
+    for kind, count in other.errors.items():
+      self.errors[kind] = self.errors.get(kind, 0) + count
+    self.connections += other.connections
+    self.handshakes += other.handshakes
+
+
+class Metrics:
+  """Fetch latency, bytes, HTTP status, parse time and errors per job and per host.
+  Job series cover what a check saw (including waiting for a shared download), host series only the actual transfers."""
+  def __init__(self):
+    self.jobs = {}
+    self.hosts = {}
+
+  def _job(self, JobID):
+    return self.jobs.setdefault(JobID, Series())
+
+  def _host(self, URL):
+    return self.hosts.setdefault(host_of(URL), Series())
+
+  def transfer(self, URL, seconds, status, size):
+    """Records a request that went over the network"""
+    self._host(URL).response(seconds, status, size)
+
+  def transfer_error(self, URL, error):
+    self._host(URL).error(type(error).__name__)
+
+  def connection(self, URL):
+    """Records a new connection to the host of the URL"""
+    self._host(URL).connections += 1
+
+  def handshake(self, URL):
+    """Records a TLS handshake with the host of the URL"""
+    self._host(URL).handshakes += 1
+
+  def fetch(self, JobID, seconds, status, size):
+    """Records the download of a check"""
+    self._job(JobID).response(seconds, status, size)
+
+  def fetch_error(self, JobID, error):
+    """Records a failed download of a check, the host already recorded it as a failed transfer"""
+    self._job(JobID).error(type(error).__name__)
+
+  def error(self, JobID, URL, error):
+    """Records a check that failed after the download"""
+    self._job(JobID).error(type(error).__name__)
+    self._host(URL).error(type(error).__name__)
+
+  @contextmanager
+  def parsing(self, JobID, URL):
+    """Records the time spent in the block as parse time of the job and the host"""
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      seconds = time.perf_counter() - start
+      self._job(JobID).parse.observe(seconds)
+      self._host(URL).parse.observe(seconds)
+
+  def forget(self, JobID):
+    """Drops the series of a deleted job"""
+    self.jobs.pop(JobID, None)
+
+  def clear(self):
+    self.jobs.clear()
+    self.hosts.clear()
+
+  def merge(self, other):
+    """Adds the series of another process, e.g. of a worker"""
+    for JobID, series in other.jobs.items():
+      self._job(JobID).merge(series)
+    for host, series in other.hosts.items():
+      self.hosts.setdefault(host, Series()).merge(series)
+
+  def slowest_jobs(self, n=5):
+    """Returns the n jobs with the highest p95 fetch latency as (JobID, Series)"""
+    return sorted(self.jobs.items(), key=lambda item: (item[1].fetch.quantile(0.95), item[1].fetch.sum), reverse=True)[:n]
+
+  def costliest_hosts(self, n=5):
+    """Returns the n hosts with the most time spent downloading and parsing as (host, Series)"""
+    return sorted(self.hosts.items(), key=lambda item: item[1].fetch.sum + item[1].parse.sum, reverse=True)[:n]
+
+  def exposition(self):
+    """Returns all metrics in the Prometheus text exposition format"""
+    lines = []
+    for scope, series in (("job", self.jobs), ("host", self.hosts)):
+      for name, attribute in (("fetch_seconds", "fetch"), ("parse_seconds", "parse")):
+        metric = f"webcheck_{scope}_{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        for key, entry in series.items():
+          histogram = getattr(entry, attribute)
+          label = f'{scope}="{_escape(key)}"'
+          cumulative = 0
+          for bound, count in zip(SECONDS_BUCKETS + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+          lines.append(f"{metric}_sum{{{label}}} {histogram.sum:.6f}")
+          lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+      lines.append(f"# TYPE webcheck_{scope}_bytes_total counter")
+      lines += [f'webcheck_{scope}_bytes_total{{{scope}="{_escape(key)}"}} {entry.bytes}' for key, entry in series.items()]
+      lines.append(f"# TYPE webcheck_{scope}_responses_total counter")
+      lines += [f'webcheck_{scope}_responses_total{{{scope}="{_escape(key)}",status="{status}"}} {count}'
+                for key, entry in series.items() for status, count in entry.statuses.items()]
+      lines.append(f"# TYPE webcheck_{scope}_errors_total counter")
+      lines += [f'webcheck_{scope}_errors_total{{{scope}="{_escape(key)}",error="{error}"}} {count}'
+                for key, entry in series.items() for error, count in entry.errors.items()]
+    for name, attribute in (("connections", "connections"), ("tls_handshakes", "handshakes")):
+      lines.append(f"# TYPE webcheck_host_{name}_total counter")
+      lines += [f'webcheck_host_{name}_total{{host="{_escape(key)}"}} {getattr(entry, attribute)}' for key, entry in self.hosts.items()]
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+
+async def serve(host, port, collect=None):
+    """Serves the metrics on http://host:port/metrics. Returns the asyncio server.
+    collect is awaited for the Metrics to show, by default those of this process."""
+    async def respond(reader, writer):
+        try:
+            request = await reader.readline()
+            # The headers of the request are not needed
+            while (await reader.readline()).strip():
+                pass
+            if request.split(b" ")[1:2] == [b"/metrics"]:
+                shown = metrics if collect is None else await collect()
+                body = shown.exposition().encode("utf-8")
+                head = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            else:
+                body = b"Not found\n"
+                head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+            writer.write(f"{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(respond, host, port)
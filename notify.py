@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from telegram.error import RetryAfter, NetworkError, TelegramError
+
+# Telegram allows about 30 messages per second overall and about one per second in a single chat
+GLOBAL_MESSAGES_PER_SECOND = 25
+CHAT_MESSAGE_INTERVAL = 1.0
+# Alarms for the same chat within this many seconds are sent as one digest message
+DIGEST_WINDOW = 2.0
+MAX_MESSAGE_LENGTH = 4096
+SEND_ATTEMPTS = 5
+# Failing jobs listed in one error digest
+ERROR_DIGEST_ENTRIES = 20
+
+logger = logging.getLogger(__name__)
+
+
+def build_digests(pending, max_length=MAX_MESSAGE_LENGTH):
+    """Merges queued (text, options) pairs into as few messages as possible.
+    Only consecutive messages with the same options are merged and no message exceeds max_length."""
+    digests = []
+    for text, options in pending:
+        text = text[:max_length]
+        if digests and digests[-1][1] == options and len(digests[-1][0]) + 2 + len(text) <= max_length:
+            digests[-1] = (digests[-1][0] + "\n\n" + text, options)
+        else:
+            digests.append((text, options))
+    return digests
+
+
+class Notifier:
+  """Central queue for outgoing messages.
+  Keeps to a global and a per-chat send rate, merges alarms for the same chat into digests and retries after flood waits."""
+  def __init__(self, messages_per_second=GLOBAL_MESSAGES_PER_SECOND, chat_interval=CHAT_MESSAGE_INTERVAL, digest_window=DIGEST_WINDOW, attempts=SEND_ATTEMPTS):
+    self.bot = None
+    self.messages_per_second = messages_per_second
+    self.chat_interval = chat_interval
+    self.digest_window = digest_window
+    self.attempts = attempts
+    self._next_global = 0.0
+    self._next_chat = {}
+    self._pending = {}
+    self._workers = {}
+    self.statistics = {"sent": 0, "merged": 0, "retries": 0, "failed": 0}
+
+  def start(self, bot):
+    self.bot = bot
+
+  async def _slot(self, chat_id):
+    """Waits until a message to the given chat may be sent"""
+    # Reserve the next start time of the chat first, so waiting for a busy chat does not hold up the others
+    now = time.monotonic()
+    chat_start = max(now, self._next_chat.get(chat_id, now))
+    self._next_chat[chat_id] = chat_start + self.chat_interval
+    if chat_start > now:
+      await asyncio.sleep(chat_start - now)
+    now = time.monotonic()
+    start = max(now, self._next_global)
+    self._next_global = start + 1 / self.messages_per_second
+    self._next_chat[chat_id] = max(self._next_chat[chat_id], start + self.chat_interval)
+    if start > now:
+      await asyncio.sleep(start - now)
+
+  async def send(self, chat_id, text, **options):
+    """Sends a message within the rate limits. Returns True if it was delivered."""
+    for attempt in range(self.attempts):
+      await self._slot(chat_id)
+      try:
+        await self.bot.send_message(chat_id=chat_id, text=text, **options)
+        self.statistics["sent"] += 1
+        return True
+      except RetryAfter as error:
+        retry_after = error.retry_after
+        seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else retry_after
+        # Flood control blocks the whole bot, so every other message waits as well
+        self._next_global = max(self._next_global, time.monotonic() + seconds)
+        self.statistics["retries"] += 1
+        logger.info("Flood control exceeded, retrying message to %s in %s seconds", chat_id, seconds)
+      except NetworkError as error:
+        self.statistics["retries"] += 1
+        logger.info("Sending to %s failed (%s), retrying", chat_id, error)
+        await asyncio.sleep(2 ** attempt)
+      except TelegramError as error:
+        # Blocked by the user, chat not found, ... retrying does not help
+        logger.info("Message to %s could not be delivered: %s", chat_id, error)
+        break
+    self.statistics["failed"] += 1
+    return False
+
+  def notify(self, chat_id, text, **options):
+    """Queues an alarm and returns at once. Alarms for the same chat within the digest window are sent as one message."""
+    self._pending.setdefault(chat_id, []).append((text, options))
+    if chat_id not in self._workers:
+      self._workers[chat_id] = asyncio.create_task(self._deliver(chat_id))
+
+  async def _deliver(self, chat_id):
+    try:
+      while self._pending.get(chat_id):
+        await asyncio.sleep(self.digest_window)
+        pending = self._pending.pop(chat_id)
+        digests = build_digests(pending)
+        self.statistics["merged"] += len(pending) - len(digests)
+        for text, options in digests:
+          await self.send(chat_id, text, **options)
+    except Exception:
+      logger.exception("Delivering alarms to %s failed", chat_id)
+    finally:
+      self._workers.pop(chat_id, None)
+
+  async def broadcast(self, chat_ids, text, **options):
+    """Sends the message to all chats concurrently within the rate limits. Returns the number of chats reached."""
+    results = await asyncio.gather(*(self.send(chat_id, text, **options) for chat_id in chat_ids))
+    return sum(results)
+
+  async def close(self):
+    """Sends the queued alarms without waiting for further ones"""
+    self.digest_window = 0
+    await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+  def summary(self):
+    """Returns a short summary of the sent, merged and failed messages"""
+    return (f'{self.statistics["sent"]} sent, {self.statistics["merged"]} merged into digests, '
+            f'{self.statistics["retries"]} retries, {self.statistics["failed"]} failed, '
+            f'{sum(len(pending) for pending in self._pending.values())} waiting')
+
+
+class ErrorDigest:
+  """Collects failed and paused checks, so the admin gets one summary per interval instead of a message per failure"""
+  def __init__(self, entries=ERROR_DIGEST_ENTRIES):
+    self.entries = entries
+    self.failures = {}
+    self.paused = {}
+    self.skipped = 0
+    self.since = time.monotonic()
+
+  def failure(self, JobID, Name, error, paused_for=0):
+    """Records a failed check of a job and, if it opened the circuit of the job, for how long it is paused"""
+    count, _, _ = self.failures.get(JobID, (0, None, None))
+    first_line = str(error).split("\n", 1)[0]
+    self.failures[JobID] = (count + 1, Name, f"{type(error).__name__}: {first_line}"[:200])
+    if paused_for:
+      self.paused[JobID] = paused_for
+
+  def skip(self, key, seconds):
+    """Records a check that was skipped because the circuit of its host or job is open"""
+    self.skipped += 1
+    self.paused[key] = max(self.paused.get(key, 0), seconds)
+
+  def take(self):
+    """Returns the summary of everything recorded since the last call (None if nothing failed) and starts over"""
+    if not self.failures and not self.skipped:
+      self.since = time.monotonic()
+      return None
+    minutes = (time.monotonic() - self.since) / 60
+    lines = [f"Check errors of the last {minutes:.0f} minutes: {sum(count for count, _, _ in self.failures.values())} failed checks "
+             f"of {len(self.failures)} jobs, {self.skipped} checks skipped"]
+    if self.paused:
+      lines.append("Paused: " + ", ".join(f"{key} ({seconds:.0f} s)" for key, seconds in sorted(self.paused.items(), key=lambda item: -item[1])[:self.entries]))
+    ranked = sorted(self.failures.items(), key=lambda item: -item[1][0])
+    lines += [f'{count}× {JobID} "{Name}": {error}' for JobID, (count, Name, error) in ranked[:self.entries]]
+    if len(ranked) > self.entries:
+      lines.append(f"and {len(ranked) - self.entries} more jobs")
+    self.failures = {}
+    self.paused = {}
+    self.skipped = 0
+    self.since = time.monotonic()
+    return "\n".join(lines)
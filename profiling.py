@@ -0,0 +1,172 @@
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Seconds between two samples of the event loop thread
+SAMPLE_INTERVAL = 0.005
+# Frames stored per traced allocation
+TRACEMALLOC_FRAMES = 10
+TOP_ENTRIES = 15
+# Directory the full reports are written to
+PROFILE_DIRECTORY = "profiles"
+
+
+def frame_key(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+  """Samples the stack of the event loop thread from a background thread and traces allocations with tracemalloc.
+  With a filter, only samples taken while a matching check runs are counted."""
+  def __init__(self, match=None, description="all checks", checks=None, interval=SAMPLE_INTERVAL):
+    self.match = match
+    self.description = description
+    self.checks_wanted = checks
+    self.interval = interval
+    self.thread_id = threading.get_ident()
+    self.samples = 0
+    self.matched = 0
+    self.checks = 0
+    self.self_counts = Counter()
+    self.total_counts = Counter()
+    self._tagged = {}
+    self._stopped = threading.Event()
+    self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+    self._started_tracing = False
+    self._baseline = None
+    self.allocations = []
+    self.traced_peak = 0
+    self.started = time.monotonic()
+    self.duration = 0.0
+
+  def start(self):
+    if not tracemalloc.is_tracing():
+      tracemalloc.start(TRACEMALLOC_FRAMES)
+      self._started_tracing = True
+    self._baseline = tracemalloc.take_snapshot()
+    self._thread.start()
+
+  def stop(self):
+    self._stopped.set()
+    self._thread.join()
+    self.duration = time.monotonic() - self.started
+    snapshot = tracemalloc.take_snapshot()
+    self.traced_peak = tracemalloc.get_traced_memory()[1]
+    if self._started_tracing:
+      tracemalloc.stop()
+    # Allocations made during the session that are still held
+    self.allocations = [stat for stat in snapshot.compare_to(self._baseline, "lineno") if stat.size_diff > 0][:TOP_ENTRIES]
+    self._tagged.clear()
+
+  def _run(self):
+    while not self._stopped.wait(self.interval):
+      frame = sys._current_frames().get(self.thread_id)
+      if frame is not None:
+        self._sample(frame)
+
+  def _sample(self, frame):
+    self.samples += 1
+    matched = self.match is None
+    stack = []
+    while frame is not None:
+      if not matched and id(frame) in self._tagged:
+        matched = True
+      stack.append(frame.f_code)
+      frame = frame.f_back
+    if not matched or not stack:
+      return
+    self.matched += 1
+    # Counted by code object, the names are only formatted for the summary
+    self.self_counts[stack[0]] += 1
+    for code in set(stack):
+      self.total_counts[code] += 1
+
+  def enter(self, frame, assignment):
+    """Marks the frame of a check. Returns False if the check does not match the filter."""
+    if self.match is not None and not self.match(assignment):
+      return False
+    self._tagged[id(frame)] = frame
+    return True
+
+  def leave(self, frame):
+    """Unmarks the frame of a finished check. Returns True if the wanted number of checks was reached."""
+    self._tagged.pop(id(frame), None)
+    self.checks += 1
+    return self.checks_wanted is not None and self.checks >= self.checks_wanted
+
+  def summary(self):
+    """Returns the top functions by own and total samples and the top allocation sites"""
+    lines = [f"Profile of {self.description}: {self.duration:.1f} s, {self.checks} checks, {self.matched} of {self.samples} samples"]
+    for title, counts in (("Top functions (own time)", self.self_counts), ("Top functions (incl. callees)", self.total_counts)):
+      lines.append("")
+      lines.append(title)
+      lines += [f"{count / self.matched * 100:5.1f}%  {frame_key(code)}" for code, count in counts.most_common(TOP_ENTRIES)]
+    lines.append("")
+    lines.append(f"Allocations still held (peak traced {self.traced_peak / 1024 / 1024:.1f} MB)")
+    for stat in self.allocations:
+      frame = stat.traceback[0]
+      lines.append(f"{stat.size_diff / 1024:8.1f} KB {stat.count_diff:6} blocks  {os.path.basename(frame.filename)}:{frame.lineno}")
+    return "\n".join(lines)
+
+
+class Profiler:
+  """Runs at most one ProfileSession at a time and hands its summary to a callback when it ends"""
+  def __init__(self):
+    self.session = None
+    self._timer = None
+    self._on_finish = None
+
+  def start(self, on_finish, match=None, description="all checks", seconds=None, checks=None):
+    """Starts a session that ends after the given seconds or number of matching checks.
+    on_finish is awaited with the summary and the path of the written report."""
+    if self.session is not None:
+      raise RuntimeError("A profile is already running")
+    self._on_finish = on_finish
+    self.session = ProfileSession(match, description, checks)
+    self.session.start()
+    if seconds:
+      self._timer = asyncio.get_running_loop().call_later(seconds, lambda: asyncio.ensure_future(self.finish()))
+
+  async def finish(self):
+    """Ends the running session and reports it"""
+    session = self.session
+    if session is None:
+      return
+    self.session = None
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+    session.stop()
+    summary = session.summary()
+    os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+    path = os.path.join(PROFILE_DIRECTORY, time.strftime("profile-%Y%m%d-%H%M%S.txt"))
+    with open(path, "w", encoding="utf-8") as file:
+      file.write(summary + "\n")
+    await self._on_finish(summary, path)
+
+
+profiler = Profiler()
+
+
+def profiled(callback):
+    """Wraps an alarm callback, so the samples of a profile session can be attributed to its checks.
+    Without a running session this costs one attribute lookup per check."""
+    @functools.wraps(callback)
+    async def check(context):
+        session = profiler.session
+        if session is None:
+            return await callback(context)
+        frame = sys._getframe()
+        if not session.enter(frame, context.job.data):
+            return await callback(context)
+        try:
+            return await callback(context)
+        finally:
+            if session.leave(frame) and session is profiler.session:
+                asyncio.ensure_future(profiler.finish())
+    return check
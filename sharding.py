@@ -0,0 +1,109 @@
+import bisect
+import hashlib
+import sqlite3
+import time
+
+from metrics import host_of
+
+# Points of every node on the hash ring, more points spread the assignments more evenly
+VIRTUAL_NODES = 64
+
+COORDINATOR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (node TEXT PRIMARY KEY, seen REAL);
+CREATE TABLE IF NOT EXISTS claims (JobID TEXT PRIMARY KEY, node TEXT, expires REAL);
+CREATE INDEX IF NOT EXISTS claims_node ON claims (node);
+"""
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shard_key(assignment, by="host"):
+    """Returns the key an assignment is placed on the ring by: the host of its Link or its JobID"""
+    return host_of(assignment.Link) if by == "host" else str(assignment.JobID)
+
+
+class HashRing:
+  """Consistent hashing of keys onto nodes.
+  A node joining or leaving only moves the keys between its points and the previous ones, all other keys keep their node."""
+  def __init__(self, nodes, virtual_nodes=VIRTUAL_NODES):
+    points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(virtual_nodes))
+    self._hashes = [point for point, _ in points]
+    self._nodes = [node for _, node in points]
+
+  def owner(self, key):
+    if not self._nodes:
+      return None
+    return self._nodes[bisect.bisect(self._hashes, _hash(key)) % len(self._nodes)]
+
+
+class SqliteCoordinator:
+  """Tracks the live nodes and the node that checks each assignment in a SQLite file all nodes open.
+  A claim is a lease that every heartbeat of its node renews, so the assignments of a node that stops are free after the timeout.
+  Claims are taken in a write transaction, so an assignment is never claimed by two nodes at once."""
+  def __init__(self, filepath, node, timeout=45):
+    self.node = node
+    self.timeout = timeout
+    # Other nodes may hold the write lock for a moment
+    self.connection = sqlite3.connect(filepath, timeout=30, isolation_level=None)
+    self.connection.execute("PRAGMA journal_mode=WAL")
+    self.connection.executescript(COORDINATOR_SCHEMA)
+    self.lease_until = 0.0
+
+  def heartbeat(self):
+    """Marks this node as alive and renews its claims. Returns the JobIDs this node still holds."""
+    now = time.time()
+    self.connection.execute("BEGIN IMMEDIATE")
+    try:
+      self.connection.execute("INSERT OR REPLACE INTO nodes (node, seen) VALUES (?, ?)", (self.node, now))
+      self.connection.execute("UPDATE claims SET expires = ? WHERE node = ?", (now + self.timeout, self.node))
+      held = {row[0] for row in self.connection.execute("SELECT JobID FROM claims WHERE node = ?", (self.node,))}
+      self.connection.execute("COMMIT")
+    except BaseException:
+      self.connection.execute("ROLLBACK")
+      raise
+    self.lease_until = now + self.timeout
+    return held
+
+  def holds(self):
+    """False once the claims of this node may have expired, e.g. after the heartbeat was blocked, so other nodes may check them"""
+    return time.time() < self.lease_until
+
+  def live_nodes(self):
+    """Returns the nodes whose last heartbeat is within the timeout"""
+    return sorted(row[0] for row in self.connection.execute("SELECT node FROM nodes WHERE seen > ?", (time.time() - self.timeout,)))
+
+  def claim(self, JobIDs):
+    """Claims the given assignments where no other node holds a valid claim. Returns the claimed JobIDs."""
+    now = time.time()
+    claimed = set()
+    self.connection.execute("BEGIN IMMEDIATE")
+    try:
+      for JobID in JobIDs:
+        row = self.connection.execute("SELECT node, expires FROM claims WHERE JobID = ?", (JobID,)).fetchone()
+        if row is None or row[0] == self.node or row[1] <= now:
+          self.connection.execute("INSERT OR REPLACE INTO claims (JobID, node, expires) VALUES (?, ?, ?)", (JobID, self.node, now + self.timeout))
+          claimed.add(JobID)
+      self.connection.execute("COMMIT")
+    except BaseException:
+      self.connection.execute("ROLLBACK")
+      raise
+    return claimed
+
+  def release(self, JobIDs):
+    """Gives up the claims of this node on the given assignments"""
+    self.connection.executemany("DELETE FROM claims WHERE JobID = ? AND node = ?", [(JobID, self.node) for JobID in JobIDs])
+
+  def leave(self):
+    """Removes this node and its claims, so the other nodes take over at their next heartbeat"""
+    self.connection.execute("DELETE FROM claims WHERE node = ?", (self.node,))
+    self.connection.execute("DELETE FROM nodes WHERE node = ?", (self.node,))
+
+  def summary(self):
+    """Returns the number of claimed assignments per live node"""
+    counts = dict(self.connection.execute("SELECT node, COUNT(*) FROM claims WHERE expires > ? GROUP BY node", (time.time(),)))
+    return ", ".join(f"{node}: {counts.get(node, 0)}" for node in self.live_nodes()) or "no live nodes"
+
+  def close(self):
+    self.connection.close()
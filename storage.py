@@ -0,0 +1,290 @@
+import io
+import pickle
+import sqlite3
+from pathlib import Path
+from telegram.ext import BasePersistence
+from assignment import Assignment, Statistics
+
+# bot_data keys that are stored row by row instead of as one pickled value
+ROW_KEYS = ("jobstorage", "userlist")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assignments (JobID TEXT PRIMARY KEY, ChatID INTEGER, Service TEXT, Link TEXT, Data BLOB);
+CREATE INDEX IF NOT EXISTS assignments_chat ON assignments (ChatID);
+CREATE TABLE IF NOT EXISTS statistics (JobID TEXT PRIMARY KEY, count INTEGER, alarm INTEGER);
+CREATE TABLE IF NOT EXISTS userlist (UserID PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS data (kind TEXT, key, value BLOB, PRIMARY KEY (kind, key));
+"""
+
+
+class BotData(dict):
+  """bot_data that is handed to the persistence as it is.
+  The persistence only writes the rows that changed, so the deep copy the Application makes before every update is not needed."""
+  def __deepcopy__(self, memo):
+    return self
+
+
+class JobRegistry:
+  """Index of the scheduled jobs by JobID and by ChatID. 
+  Kept in sync with the job queue, so looking up a job or the jobs of a chat does not scan the whole queue."""
+  def __init__(self):
+    self.jobs = {}
+    self.by_chat = {}
+
+  def add(self, job):
+    self.jobs[job.data.JobID] = job
+    self.by_chat.setdefault(job.data.ChatID, {})[job.data.JobID] = job
+
+  def remove(self, JobID):
+    """Removes the job from the index and returns it (or None)"""
+    job = self.jobs.pop(JobID, None)
+    if job is not None:
+      chat_jobs = self.by_chat.get(job.data.ChatID, {})
+      chat_jobs.pop(JobID, None)
+      if not chat_jobs:
+        self.by_chat.pop(job.data.ChatID, None)
+    return job
+
+  def get(self, JobID):
+    return self.jobs.get(JobID)
+
+  def of_chat(self, ChatID):
+    """Returns the jobs of the given chat in the order they were added"""
+    return list(self.by_chat.get(ChatID, {}).values())
+
+  def clear(self):
+    self.jobs.clear()
+    self.by_chat.clear()
+
+  def __len__(self):
+    return len(self.jobs)
+
+
+class _AssignmentUnpickler(pickle.Unpickler):
+  """Loads assignments pickled by older versions, which defined Assignment in bot.py (as __main__ when run as a script)"""
+  def find_class(self, module, name):
+    if module in ("__main__", "bot") and name == "Assignment":
+      return Assignment
+    return super().find_class(module, name)
+
+
+def _load_assignment(data):
+    return _AssignmentUnpickler(io.BytesIO(data)).load()
+
+
+class _LegacyUnpickler(_AssignmentUnpickler):
+  """Reads the file of the former PicklePersistence. References to the Bot are not needed and dropped."""
+  def persistent_load(self, pid):
+    return None
+
+
+class SqlitePersistence(BasePersistence):
+  """Persistence backed by SQLite (WAL).
+  Assignments, their statistics and the userlist are separate rows, so a counter bump or a single job change writes only that row.
+  Data of the former PicklePersistence is imported on the first start."""
+  def __init__(self, filepath="bot_storage.sqlite", legacy_filepath="bot_storage", update_interval=60, store_data=None):
+    super().__init__(store_data=store_data, update_interval=update_interval)
+    # Checker nodes share the file with the bot, see sharding.py
+    self.connection = sqlite3.connect(filepath, timeout=30)
+    self.connection.execute("PRAGMA journal_mode=WAL")
+    self.connection.execute("PRAGMA synchronous=NORMAL")
+    self.connection.executescript(SCHEMA)
+    # Last written state per JobID, used to find the rows that changed
+    self._written_assignments = {}
+    self._written_statistics = {}
+    self._written_userlist = []
+    self._written_values = {}
+    # JobIDs whose stored rows this node may update, None for all. Checker nodes set it to the assignments they hold the claim for.
+    self.owned = None
+    if legacy_filepath and Path(legacy_filepath).exists() and not self._load("meta", "legacy_imported"):
+      self._import_legacy(legacy_filepath)
+
+  def _load(self, kind, key, default=None):
+    row = self.connection.execute("SELECT value FROM data WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+    return pickle.loads(row[0]) if row else default
+
+  def _load_all(self, kind):
+    return {key: pickle.loads(value) for key, value in self.connection.execute("SELECT key, value FROM data WHERE kind = ?", (kind,))}
+
+  def _store(self, kind, key, value):
+    with self.connection:
+      self.connection.execute("INSERT OR REPLACE INTO data (kind, key, value) VALUES (?, ?, ?)", (kind, key, pickle.dumps(value)))
+
+  def _delete(self, kind, key):
+    with self.connection:
+      self.connection.execute("DELETE FROM data WHERE kind = ? AND key = ?", (kind, key))
+
+  def _import_legacy(self, legacy_filepath):
+    """Imports all data of the given PicklePersistence file"""
+    with open(legacy_filepath, "rb") as file:
+      legacy = _LegacyUnpickler(file).load()
+    for user_id, data in (legacy.get("user_data") or {}).items():
+      self._store("user_data", user_id, data)
+    for chat_id, data in (legacy.get("chat_data") or {}).items():
+      self._store("chat_data", chat_id, data)
+    for name, conversation in (legacy.get("conversations") or {}).items():
+      self._store("conversations", name, conversation)
+    if legacy.get("callback_data") is not None:
+      self._store("callback_data", "", legacy["callback_data"])
+    self._write_bot_data(legacy.get("bot_data") or {})
+    self._store("meta", "legacy_imported", True)
+
+  @staticmethod
+  def _state(assignment):
+    """All stored fields of an Assignment except the Statistics, which have their own table"""
+    return tuple(getattr(assignment, name) for name in assignment.FIELDS if name != "Statistics")
+
+  def _is_written(self, assignment):
+    written = self._written_assignments.get(assignment.JobID)
+    if written is None:
+      return False
+    # Alarms replace the stored update instead of changing it, so comparing identities is enough
+    state = self._state(assignment)
+    return len(state) == len(written) and all(a is b for a, b in zip(state, written))
+
+  def _write_bot_data(self, data):
+    """Writes the rows of bot_data that changed since the last call"""
+    with self.connection:
+      jobstorage = data.get("jobstorage") or {}
+      if not isinstance(jobstorage, dict):
+        # The former PicklePersistence stored a list
+        jobstorage = {assignment.JobID: assignment for assignment in jobstorage}
+      for JobID in self._written_assignments.keys() - jobstorage.keys():
+        self.connection.execute("DELETE FROM assignments WHERE JobID = ?", (JobID,))
+        self.connection.execute("DELETE FROM statistics WHERE JobID = ?", (JobID,))
+        del self._written_assignments[JobID]
+        self._written_statistics.pop(JobID, None)
+      for JobID, assignment in jobstorage.items():
+        if self.owned is not None and JobID in self._written_assignments and JobID not in self.owned:
+          # The row belongs to the node holding the claim, its copy here may be outdated
+          continue
+        # Rows that were written before are only updated, so a row another node deleted in the meantime stays deleted
+        if not self._is_written(assignment):
+          if JobID in self._written_assignments:
+            self.connection.execute(
+              "UPDATE assignments SET ChatID = ?, Service = ?, Link = ?, Data = ? WHERE JobID = ?",
+              (assignment.ChatID, assignment.Service, assignment.Link, pickle.dumps(assignment), JobID))
+          else:
+            self.connection.execute(
+              "INSERT OR REPLACE INTO assignments (JobID, ChatID, Service, Link, Data) VALUES (?, ?, ?, ?, ?)",
+              (JobID, assignment.ChatID, assignment.Service, assignment.Link, pickle.dumps(assignment)))
+          self._written_assignments[JobID] = self._state(assignment)
+        statistics = (assignment.Statistics.count, assignment.Statistics.alarm)
+        if self._written_statistics.get(JobID) != statistics:
+          if JobID in self._written_statistics:
+            self.connection.execute("UPDATE statistics SET count = ?, alarm = ? WHERE JobID = ?", (*statistics, JobID))
+          else:
+            self.connection.execute("INSERT OR REPLACE INTO statistics (JobID, count, alarm) VALUES (?, ?, ?)", (JobID, *statistics))
+          self._written_statistics[JobID] = statistics
+
+      userlist = list(data.get("userlist") or [])
+      if userlist != self._written_userlist:
+        self.connection.execute("DELETE FROM userlist")
+        self.connection.executemany("INSERT OR IGNORE INTO userlist (UserID) VALUES (?)", [(UserID,) for UserID in userlist])
+        self._written_userlist = userlist
+
+      for key, value in data.items():
+        if key in ROW_KEYS:
+          continue
+        pickled = pickle.dumps(value)
+        if self._written_values.get(key) != pickled:
+          self.connection.execute("INSERT OR REPLACE INTO data (kind, key, value) VALUES ('bot_data', ?, ?)", (key, pickled))
+          self._written_values[key] = pickled
+
+  async def get_bot_data(self):
+    bot_data = BotData(self._load_all("bot_data"))
+    self._written_values = {key: pickle.dumps(value) for key, value in bot_data.items()}
+    jobstorage = self.read_assignments()
+    # Rows of older versions are rewritten in the current format right away
+    with self.connection:
+      self.connection.executemany("UPDATE assignments SET Data = ? WHERE JobID = ?",
+                                  [(pickle.dumps(assignment), JobID) for JobID, assignment in jobstorage.items() if assignment.Upgraded])
+    for assignment in jobstorage.values():
+      assignment.Upgraded = False
+      self.mark_written(assignment)
+    bot_data["jobstorage"] = jobstorage
+    bot_data["userlist"] = [row[0] for row in self.connection.execute("SELECT UserID FROM userlist ORDER BY rowid")]
+    self._written_userlist = list(bot_data["userlist"])
+    return bot_data
+
+  def stored_job_ids(self):
+    """Returns the JobIDs of all stored assignments, including those other nodes added"""
+    return {row[0] for row in self.connection.execute("SELECT JobID FROM assignments")}
+
+  def read_assignments(self, JobIDs=None):
+    """Reads the given (or all) assignments with their statistics as they are stored now"""
+    if JobIDs is None:
+      return self._read_assignments("", ())
+    JobIDs = list(JobIDs)
+    assignments = {}
+    # Stays below the SQLite limit of query parameters
+    for start in range(0, len(JobIDs), 500):
+      chunk = JobIDs[start:start + 500]
+      assignments.update(self._read_assignments(f" WHERE JobID IN ({', '.join('?' * len(chunk))})", chunk))
+    return assignments
+
+  def _read_assignments(self, where, parameters):
+    statistics = {JobID: Statistics(count, alarm) for JobID, count, alarm in
+                  self.connection.execute("SELECT JobID, count, alarm FROM statistics" + where, parameters)}
+    assignments = {}
+    for JobID, data in self.connection.execute("SELECT JobID, Data FROM assignments" + where + " ORDER BY rowid", parameters):
+      assignment = _load_assignment(data)
+      assignment.Statistics = statistics.get(JobID, assignment.Statistics)
+      assignments[JobID] = assignment
+    return assignments
+
+  def mark_written(self, assignment):
+    """Remembers the assignment as written, e.g. after reading it with read_assignments"""
+    self._written_assignments[assignment.JobID] = self._state(assignment)
+    self._written_statistics[assignment.JobID] = (assignment.Statistics.count, assignment.Statistics.alarm)
+
+  async def update_bot_data(self, data):
+    self._write_bot_data(data)
+
+  async def refresh_bot_data(self, bot_data):
+    pass
+
+  async def get_user_data(self):
+    return self._load_all("user_data")
+
+  async def update_user_data(self, user_id, data):
+    self._store("user_data", user_id, data)
+
+  async def drop_user_data(self, user_id):
+    self._delete("user_data", user_id)
+
+  async def refresh_user_data(self, user_id, user_data):
+    pass
+
+  async def get_chat_data(self):
+    return self._load_all("chat_data")
+
+  async def update_chat_data(self, chat_id, data):
+    self._store("chat_data", chat_id, data)
+
+  async def drop_chat_data(self, chat_id):
+    self._delete("chat_data", chat_id)
+
+  async def refresh_chat_data(self, chat_id, chat_data):
+    pass
+
+  async def get_callback_data(self):
+    return self._load("callback_data", "")
+
+  async def update_callback_data(self, data):
+    self._store("callback_data", "", data)
+
+  async def get_conversations(self, name):
+    return self._load("conversations", name, {})
+
+  async def update_conversation(self, name, key, new_state):
+    conversations = self._load("conversations", name, {})
+    if new_state is None:
+      conversations.pop(key, None)
+    else:
+      conversations[key] = new_state
+    self._store("conversations", name, conversations)
+
+  async def flush(self):
+    self.connection.commit()
+    self.connection.close()
@@ -0,0 +1,161 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import pickle
+import threading
+import zlib
+
+import logic
+from metrics import host_of
+
+# Seconds a check may take in a worker before the bot gives up on it
+CHECK_TIMEOUT = 120
+
+logger = logging.getLogger(__name__)
+
+
+def _picklable(error):
+    """Returns the exception itself if it can be sent to the bot, otherwise a RuntimeError describing it"""
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _diagnostics():
+    # Pickled right away, the queue would pickle it in its feeder thread while the checks keep counting
+    return pickle.dumps(logic.diagnostics())
+
+
+# Requests of the bot besides the checks
+COMMANDS = {"forget_job": logic.forget_job, "diagnostics": _diagnostics}
+
+
+async def _run(number, name, arguments, results):
+    if number is None:
+        # A message of the bot without result, see WorkerPool.forget
+        COMMANDS[name](*arguments)
+        return
+    try:
+        if name in COMMANDS:
+            results.put((number, COMMANDS[name](*arguments), None))
+        else:
+            results.put((number, await logic.CHECKS[name](*arguments), None))
+    except Exception as err:
+        results.put((number, None, _picklable(err)))
+
+
+async def _serve(requests, results):
+    """Runs every check it receives concurrently on the event loop of the worker until it receives None"""
+    loop = asyncio.get_running_loop()
+    running = set()
+    while True:
+        request = await loop.run_in_executor(None, requests.get)
+        if request is None:
+            break
+        task = asyncio.ensure_future(_run(*request, results))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    await asyncio.gather(*running)
+    await logic.close_client()
+
+
+def worker_main(requests, results):
+    """Entry point of a worker process"""
+    try:
+        asyncio.run(_serve(requests, results))
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerPool:
+  """Runs the download, parse and compare steps of checks in worker processes and returns their CheckResult.
+  All checks of a host go to the same worker, so its per-host limits, shared downloads and conditional requests keep working."""
+  def __init__(self, processes):
+    # Forking a process with a running event loop and threads is not safe
+    self._context = multiprocessing.get_context("spawn")
+    self._results = self._context.Queue()
+    self._requests = [self._context.Queue() for _ in range(processes)]
+    self._processes = [None] * processes
+    self._futures = {}
+    self._numbers = itertools.count()
+    self._loop = None
+    self._reader = None
+
+  def _start_worker(self, index):
+    process = self._context.Process(target=worker_main, args=(self._requests[index], self._results), name=f"checker-{index}", daemon=True)
+    process.start()
+    self._processes[index] = process
+
+  def start(self):
+    self._loop = asyncio.get_running_loop()
+    for index in range(len(self._processes)):
+      self._start_worker(index)
+    self._reader = threading.Thread(target=self._read, name="checker-results", daemon=True)
+    self._reader.start()
+
+  def _read(self):
+    while True:
+      message = self._results.get()
+      if message is None:
+        return
+      self._loop.call_soon_threadsafe(self._resolve, *message)
+
+  def _resolve(self, number, result, error):
+    future = self._futures.pop(number, None)
+    if future is None or future.done():
+      return
+    if error is not None:
+      future.set_exception(error)
+    else:
+      future.set_result(result)
+
+  def _index(self, Link):
+    return zlib.crc32(host_of(Link).encode()) % len(self._processes)
+
+  async def check(self, name, JobID, Name, Link, Search_For, Stored_Update, max_age=logic.FRESHNESS_WINDOW):
+    """Runs the named check (see logic.CHECKS) in the worker of the host of the Link"""
+    index = self._index(Link)
+    if not self._processes[index].is_alive():
+      logger.info("Worker %s stopped with exit code %s, restarting it", index, self._processes[index].exitcode)
+      self._start_worker(index)
+    return await self._request(index, name, (JobID, Name, Link, Search_For, Stored_Update, max_age))
+
+  async def _request(self, index, name, arguments):
+    number = next(self._numbers)
+    future = self._loop.create_future()
+    self._futures[number] = future
+    self._requests[index].put((number, name, arguments))
+    try:
+      return await asyncio.wait_for(future, CHECK_TIMEOUT)
+    finally:
+      self._futures.pop(number, None)
+
+  async def diagnostics(self):
+    """Returns the diagnostics (see logic.diagnostics) of the running workers"""
+    snapshots = await asyncio.gather(*(self._request(index, "diagnostics", ())
+                                       for index, process in enumerate(self._processes) if process.is_alive()))
+    return [pickle.loads(snapshot) for snapshot in snapshots]
+
+  def forget(self, JobID, Link):
+    """Drops the state of a deleted job in the worker of the host of its Link"""
+    index = self._index(Link)
+    if self._processes[index].is_alive():
+      self._requests[index].put((None, "forget_job", (JobID,)))
+
+  async def close(self):
+    """Lets the workers finish their running checks and stops them"""
+    for requests in self._requests:
+      requests.put(None)
+    await self._loop.run_in_executor(None, self._join)
+    self._results.put(None)
+    for future in self._futures.values():
+      future.cancel()
+
+  def _join(self):
+    for process in self._processes:
+      process.join(CHECK_TIMEOUT)
+      if process.is_alive():
+        process.terminate()